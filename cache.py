@@ -0,0 +1,86 @@
+#!/usr/bin/python
+
+import re
+import time
+import threading
+from collections import OrderedDict
+
+# Compiled regular expressions to classify the cached commands
+whitespace_re = re.compile("\s+")
+show_cmd_re   = re.compile("^sh(o(w)?)?\s")
+
+def normalize(command):
+    """collapse the whitespaces of a command so that equivalent commands share an entry"""
+    return whitespace_re.sub(" ",command.strip())
+
+def is_cacheable(command):
+    """only show commands are cached, anything else may change the device state"""
+    return show_cmd_re.match(normalize(command)) is not None
+
+class CommandCache(object):
+    """CommandCache is a size-bounded LRU cache of command outputs with a TTL
+
+    Entries are keyed by (device name, normalized command) so that one cache can be
+    shared by all the devices of a run. Device.send_cmd looks the output up here before
+    going to the console, and every operation that may change the configuration
+    invalidates the entries of its device.
+
+    Attributes:
+        _ttl     : a float holding the number of seconds an entry stays valid
+        _maxsize : an integer holding the maximum number of entries
+        _entries : an OrderedDict of key to (expiry time, output), oldest first
+        _lock    : a threading.Lock protecting the entries and the counters
+        _hits    : an integer counting the lookups served from the cache
+        _misses  : an integer counting the lookups which went to the device
+        _evictions : an integer counting the entries dropped by the LRU bound
+    """
+
+    def __init__(self,ttl=60,maxsize=1024):
+        self._ttl       = ttl
+        self._maxsize   = maxsize
+        self._entries   = OrderedDict()
+        self._lock      = threading.Lock()
+        self._hits      = 0
+        self._misses    = 0
+        self._evictions = 0
+
+    def get(self,name,command):
+        """return the cached output of a command on a device, None on a miss"""
+        key = (name,normalize(command))
+        with self._lock:
+            entry = self._entries.pop(key,None)
+            if entry is None or entry[0] < time.time():
+                self._misses = self._misses + 1
+                return None
+            self._entries[key] = entry
+            self._hits = self._hits + 1
+            return entry[1]
+
+    def put(self,name,command,output):
+        """store the output of a command on a device"""
+        key = (name,normalize(command))
+        with self._lock:
+            self._entries.pop(key,None)
+            self._entries[key] = (time.time() + self._ttl,output)
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+                self._evictions = self._evictions + 1
+
+    def invalidate(self,name=None):
+        """drop the entries of a device, or every entry when name is None"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+                return
+            for key in [key for key in self._entries if key[0] == name]:
+                del self._entries[key]
+
+    def stats(self):
+        """return a dictionary of the hit/miss counters of the cache"""
+        with self._lock:
+            total = self._hits + self._misses
+            return {"hits"      : self._hits,
+                    "misses"    : self._misses,
+                    "evictions" : self._evictions,
+                    "entries"   : len(self._entries),
+                    "hit_ratio" : float(self._hits) / total if total else 0.0}
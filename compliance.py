@@ -0,0 +1,296 @@
+#!/usr/bin/python
+
+import os
+import re
+import glob
+import json
+import time
+import shutil
+import tempfile
+import multiprocessing
+from collections import namedtuple
+
+# Rule kinds
+REQUIRED = "required"  # a line matching the rule must be present in the config
+BANNED   = "banned"    # no line of the config may match the rule
+RANGE    = "range"     # the ids captured by the first group of the rule must be in range
+
+REPORT_DIR = "compliance"
+
+# Violations returned by the checks, line_number is None for a missing required line
+Violation = namedtuple("Violation",["rule","line_number","line","message"])
+
+# Compiled regular expression to turn the named groups of the rules into plain groups
+group_name_re = re.compile("\(\?P<\w+>")
+
+class ComplianceException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+class Rule(object):
+    """Rule is one policy line a configuration is checked against
+
+    The regex is matched at the start of the configuration lines, so a rule on an
+    interface sub-command starts with [ \\t]+ (\s would let the matcher span lines).
+
+    Attributes:
+        name        : a string naming the rule in the reports
+        kind        : a string, one of REQUIRED, BANNED or RANGE
+        regex       : a string holding the regular expression of the rule
+        low         : an integer holding the lowest id allowed by a RANGE rule
+        high        : an integer holding the highest id allowed by a RANGE rule
+        description : a string explaining the rule
+    """
+
+    def __init__(self,name,kind,regex,low=None,high=None,description=""):
+        if kind not in [REQUIRED,BANNED,RANGE]:
+            raise ComplianceException("Unknown kind %s of rule %s" % (kind,name))
+        if kind == RANGE and (low is None or high is None):
+            raise ComplianceException("Range rule %s needs both low and high" % name)
+        self.name        = name
+        self.kind        = kind
+        self.regex       = regex
+        self.low         = low
+        self.high        = high
+        self.description = description
+
+# Policy of the lab configs
+DEFAULT_RULES = [Rule("aaa-new-model",REQUIRED,"aaa new-model",
+                      description="AAA must be enabled"),
+                 Rule("aaa-authentication",REQUIRED,"aaa authentication login default ",
+                      description="the default login method list must be set"),
+                 Rule("password-encryption",BANNED,"no service password-encryption",
+                      description="passwords must not be stored in clear text"),
+                 Rule("vlan-range",RANGE,"vlan (\d[\d,\-]*)\s*$",1,1005,
+                      description="lab VLANs must stay in the normal range"),
+                 Rule("access-vlan-range",RANGE,"[ \t]+switchport access vlan (\d+)",1,1005,
+                      description="access ports must stay in the normal VLAN range")]
+
+def load_rules(path):
+    """load rules from a json file holding a list of the Rule attributes
+
+       Raises:
+           ComplianceException : the file does not describe valid rules
+    """
+    try:
+        with open(path) as f:
+            return [Rule(**rule) for rule in json.load(f)]
+    except (IOError,ValueError,TypeError) as e:
+        raise ComplianceException("Unable to load rules from %s : %s" % (path,e))
+
+def _ids(s):
+    ids = []
+    for item in s.split(","):
+        bounds = item.split("-")
+        if bounds[0] == "":
+            continue
+        if len(bounds) == 1 or bounds[1] == "":
+            ids.append(int(bounds[0]))
+        else:
+            ids.extend(range(int(bounds[0]),int(bounds[1]) + 1))
+    return ids
+
+class RuleSet(object):
+    """RuleSet is a list of rules compiled into a single matcher
+
+    Every rule becomes one alternative of a combined regex anchored at the start of
+    the lines, so a configuration is scanned once whatever the number of rules and
+    only the lines hit by the matcher are looked at in python. The alternative which
+    matched tells the first rule of the line; the later rules are tried on that line
+    only, so a line matching several rules is not missed.
+
+    Attributes:
+        _rules    : a list of (Rule,compiled regex) tuples
+        _matcher  : the compiled combined regex
+        _groups   : a dictionary of the group index of every alternative to its rule index
+    """
+
+    def __init__(self,rules=None):
+        rules = DEFAULT_RULES if rules is None else rules
+        self._rules   = [(rule,re.compile(rule.regex)) for rule in rules]
+        self._groups  = {}
+        alternatives  = []
+        index         = 1
+        for i,(rule,regex) in enumerate(self._rules):
+            self._groups[index] = i
+            alternatives.append("(" + group_name_re.sub("(?:",rule.regex) + ")")
+            index = index + 1 + regex.groups
+        self._matcher = re.compile("^(?:" + "|".join(alternatives) + ")",re.M)
+
+    @property
+    def rules(self):
+        return [rule for rule,regex in self._rules]
+
+    def check(self,config):
+        """check a configuration against the rules
+
+           Args:
+               config : a string holding the whole configuration
+
+           Returns:
+               A list of Violation tuples ordered by line
+        """
+        violations = []
+        seen       = set()
+        line_number = 1
+        position    = 0
+        for m in self._matcher.finditer(config):
+            line_number = line_number + config.count("\n",position,m.start())
+            position    = m.start()
+            end  = config.find("\n",position)
+            line = config[position:] if end == -1 else config[position:end]
+            line = line.rstrip("\r")
+            for rule,regex in self._rules[self._groups[m.lastindex]:]:
+                match = regex.match(line)
+                if match is None:
+                    continue
+                if rule.kind == REQUIRED:
+                    seen.add(rule.name)
+                elif rule.kind == BANNED:
+                    violations.append(Violation(rule.name,line_number,line,rule.description))
+                else:
+                    bad = [i for i in _ids(match.group(1)) if i < rule.low or i > rule.high]
+                    if bad != []:
+                        violations.append(Violation(rule.name,line_number,line,
+                                                    "%s out of %s-%s" \
+                                                    % (",".join([str(i) for i in bad]),
+                                                       rule.low,rule.high)))
+        for rule,regex in self._rules:
+            if rule.kind == REQUIRED and rule.name not in seen:
+                violations.append(Violation(rule.name,None,"",rule.description))
+        return violations
+
+def write_report(name,violations,execution_name,report_dir=REPORT_DIR):
+    """write the violations of a device to compliance/$execution_name/$devicename.txt
+
+       An empty report means the device is compliant.
+    """
+    path = os.path.join(report_dir,execution_name)
+    if os.path.isdir(path) == False:
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created meanwhile by another device
+            pass
+    with open(os.path.join(path,name + ".txt"),"w") as f:
+        for v in violations:
+            f.write("%-24s %-10s %s : %s\n" \
+                    % (v.rule,"missing" if v.line_number is None else "line %s" % v.line_number,
+                       v.line,v.message))
+
+# Rule set of a pool worker, compiled once per process
+_worker_rules = None
+
+def _init_worker(rules):
+    global _worker_rules
+    _worker_rules = RuleSet(rules)
+
+def _check_file(path):
+    with open(path) as f:
+        config = f.read()
+    return os.path.basename(path)[:-len(".cfg")],_worker_rules.check(config)
+
+def check_archive(execution_name,rules=None,processes=None,archive_dir="config_archive",
+                  report_dir=REPORT_DIR):
+    """check every config archived by an execution on a pool of processes
+
+       Args:
+           execution_name : a string holding the execution whose configs are checked
+           rules          : a list of Rule objects, DEFAULT_RULES when None
+           processes      : an integer holding the size of the pool, one per cpu when None
+           archive_dir    : a string holding the config archive directory
+           report_dir     : a string holding the directory the reports are written to,
+                            no report is written when None
+
+       Returns:
+           A dictionary of device name to its list of violations
+    """
+    paths = sorted(glob.glob(os.path.join(archive_dir,execution_name,"*.cfg")))
+    if paths == []:
+        return {}
+    processes = processes or multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(processes,initializer=_init_worker,initargs=(rules,))
+    try:
+        results = dict(pool.map(_check_file,paths,
+                                chunksize=max(1,len(paths) / (processes * 4))))
+    finally:
+        pool.close()
+        pool.join()
+    if report_dir is not None:
+        for name,violations in results.items():
+            write_report(name,violations,execution_name,report_dir)
+    return results
+
+def _naive_check(rules,config):
+    # the former one-off scripts: every rule run on every line
+    violations = []
+    lines = config.split("\n")
+    for rule in rules:
+        regex = re.compile(rule.regex)
+        found = False
+        for i,line in enumerate(lines):
+            m = regex.match(line)
+            if m is None:
+                continue
+            found = True
+            if rule.kind == BANNED:
+                violations.append(Violation(rule.name,i + 1,line,rule.description))
+            elif rule.kind == RANGE:
+                if [j for j in _ids(m.group(1)) if j < rule.low or j > rule.high] != []:
+                    violations.append(Violation(rule.name,i + 1,line,rule.description))
+        if rule.kind == REQUIRED and found == False:
+            violations.append(Violation(rule.name,None,"",rule.description))
+    return violations
+
+def benchmark(devices=2000,processes=None):
+    """compare the rule by rule scripts with the compiled rule set on a synthetic archive
+
+       Returns:
+           A dictionary of method to its elapsed seconds
+    """
+    archive_dir = tempfile.mkdtemp()
+    os.makedirs(os.path.join(archive_dir,"bench"))
+    for i in range(devices):
+        lines = ["version 12.4","hostname %dR%d" % (i / 4 + 1,i % 4 + 1)]
+        if i % 7 != 0:
+            lines.append("aaa new-model")
+            lines.append("aaa authentication login default local")
+        if i % 11 == 0:
+            lines.append("no service password-encryption")
+        for j in range(24):
+            lines.extend(["interface FastEthernet0/%d" % j,
+                          " description port %d" % j,
+                          " switchport access vlan %d" % (4000 if i % 13 == 0 and j == 0 else 10 + j),
+                          " spanning-tree portfast","!"])
+        lines.append("vlan 10-33")
+        lines.extend(["line vty 0 4"," password cisco"," login","!","end"])
+        with open(os.path.join(archive_dir,"bench","%d.cfg" % i),"w") as f:
+            f.write("\n".join(lines) + "\n")
+    paths = glob.glob(os.path.join(archive_dir,"bench","*.cfg"))
+    results = {}
+    try:
+        start = time.time()
+        for path in paths:
+            with open(path) as f:
+                _naive_check(DEFAULT_RULES,f.read())
+        results["naive"] = time.time() - start
+
+        start = time.time()
+        ruleset = RuleSet()
+        for path in paths:
+            with open(path) as f:
+                ruleset.check(f.read())
+        results["compiled"] = time.time() - start
+
+        start = time.time()
+        check_archive("bench",processes=processes,archive_dir=archive_dir,report_dir=None)
+        results["pool"] = time.time() - start
+    finally:
+        shutil.rmtree(archive_dir)
+    return results
+
+if __name__ == "__main__":
+    for method,elapsed in sorted(benchmark().items(),key=lambda item: item[1],reverse=True):
+        print "%-8s : %.3fs" % (method,elapsed)
@@ -0,0 +1,162 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import logging
+import threading
+from collections import deque
+from termcolor import colored
+import journal
+
+# Status of a device which did not start yet, the others are the journal ones
+PENDING = "pending"
+
+# Cell marker and color of every status
+MARKERS = {PENDING          : (".","white"),
+           journal.STARTED  : (">","yellow"),
+           journal.DONE     : (">","yellow"),
+           journal.FAILED   : ("x","red"),
+           journal.COMPLETE : ("+","green")}
+
+# ANSI sequence moving the cursor home and clearing the screen, instead of forking clear
+CLEAR = "\033[H\033[J"
+
+# Number of error messages kept at the bottom of the dashboard
+MESSAGES = 8
+
+class _DeviceState(object):
+    """_DeviceState holds what the dashboard shows of one device"""
+
+    def __init__(self):
+        self.stage  = ""
+        self.status = PENDING
+        self.since  = None
+
+class DashboardHandler(logging.Handler):
+    """DashboardHandler turns the warning and error records of a device logger into
+    dashboard messages, in place of a StreamHandler writing over the dashboard"""
+
+    def __init__(self,dashboard,name):
+        logging.Handler.__init__(self,logging.WARNING)
+        self.dashboard = dashboard
+        self.name      = name
+
+    def emit(self,record):
+        self.dashboard.message(self.name,record.getMessage())
+
+class Dashboard(object):
+    """Dashboard renders the progress of a fleet of devices at a fixed refresh rate
+
+    Workers never write to the console: they post status events, which only append
+    a tuple to a deque and return, and a render thread of its own drains the events
+    and redraws the whole screen in a single write every interval seconds. The
+    per-device output stays in the logs/<execution_name> files.
+
+    Attributes:
+        _names    : a list of the device names in display order
+        _states   : a dictionary of device name to its _DeviceState object
+        _events   : a deque of the posted (time,name,stage,status) events
+        _messages : a deque of the last (time,name,message) error messages
+        _interval : a float holding the seconds between two renders
+        _stream   : the file object the dashboard is rendered to
+        _start    : a float holding the epoch time the dashboard was started
+        _thread   : the render threading.Thread object
+        _running  : a boolean, False once the dashboard is stopped
+    """
+
+    def __init__(self,names,interval=0.5,stream=None):
+        self._names    = list(names)
+        self._states   = dict([(name,_DeviceState()) for name in self._names])
+        self._events   = deque()
+        self._messages = deque(maxlen=MESSAGES)
+        self._interval = interval
+        self._stream   = stream if stream is not None else sys.stdout
+        self._start    = None
+        self._thread   = None
+        self._running  = False
+
+    def post(self,name,stage,status):
+        """record a stage transition of a device, safe to call from any thread"""
+        self._events.append((time.time(),name,stage,status))
+
+    def message(self,name,message):
+        """record an error message of a device, safe to call from any thread"""
+        self._messages.append((time.time(),name,message))
+
+    def handler(self,name):
+        """return a logging handler forwarding the errors of a device logger"""
+        return DashboardHandler(self,name)
+
+    def _drain(self):
+        while True:
+            try:
+                t,name,stage,status = self._events.popleft()
+            except IndexError:
+                return
+            state = self._states.get(name)
+            if state is None:
+                state = self._states[name] = _DeviceState()
+                self._names.append(name)
+            state.stage  = stage
+            state.status = status
+            state.since  = t
+
+    def render(self):
+        """return the current frame of the dashboard as a string"""
+        self._drain()
+        now    = time.time()
+        counts = dict([(status,0) for status in MARKERS])
+        for state in self._states.values():
+            counts[state.status] = counts[state.status] + 1
+        finished = counts[journal.COMPLETE] + counts[journal.FAILED]
+        elapsed  = now - self._start if self._start is not None else 0.0
+        lines = ["%s/%s devices finished   %s complete   %s failed   %s running   %s pending" \
+                 "   elapsed %ds" \
+                 % (finished,len(self._names),counts[journal.COMPLETE],counts[journal.FAILED],
+                    counts[journal.STARTED] + counts[journal.DONE],counts[PENDING],elapsed),
+                 ""]
+        width   = 24
+        columns = max(1,int(os.environ.get("COLUMNS",80)) / width)
+        row     = []
+        for name in self._names:
+            state = self._states[name]
+            marker,color = MARKERS[state.status]
+            stage = state.stage
+            if state.status in [journal.STARTED,journal.DONE] and state.since is not None:
+                stage = "%s %ds" % (stage,now - state.since)
+            row.append(colored(marker,color) + " " + ("%-6s %-14s" % (name,stage[:14])))
+            if len(row) == columns:
+                lines.append(" ".join(row))
+                row = []
+        if row != []:
+            lines.append(" ".join(row))
+        if self._messages:
+            lines.append("")
+            for t,name,message in list(self._messages):
+                lines.append(colored("%s %-6s %s" % (time.strftime("%H:%M:%S",time.localtime(t)),
+                                                     name,message),"red"))
+        return "\n".join(lines) + "\n"
+
+    def _refresh(self):
+        self._stream.write(CLEAR + self.render())
+        self._stream.flush()
+
+    def _run(self):
+        while self._running:
+            self._refresh()
+            time.sleep(self._interval)
+
+    def start(self):
+        self._start   = time.time()
+        self._running = True
+        self._thread  = threading.Thread(target=self._run)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """stop the render thread and render the final frame"""
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        self._refresh()
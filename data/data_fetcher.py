@@ -1,5 +1,14 @@
+import re
+import raw_data
 from raw_data import all_routers,all_switches
 
+# optional in raw_data, an inventory without them has no per-device variables and
+# no terminal server limits
+device_vars    = getattr(raw_data,"device_vars",{})
+termsrv_limits = getattr(raw_data,"termsrv_limits",{})
+
+device_name_re = re.compile("(\d+)(\w)(\d)")
+
 class PodNumberError(Exception):
     def __init__(self,error_string):
         self.error_string = error_string
@@ -18,6 +27,12 @@ class SwitchNumberError(Exception):
     def __str__(self):
         return repr(self.error_string)
 
+class DeviceNameError(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
 def get_pod_term_serv(pod_number_list):
     """ retrieve a list of terminal servers by specifying the pod_number_list
 
@@ -107,7 +122,6 @@ def get_pod_switches(pod_number_list,switch_number_list):
         SwitchNumberError : when switch number is given out of range
     """  
     ###Preprocessing of switch_number_list###
-    print switch_number_list
     for i in range(len(switch_number_list)):
             if (switch_number_list[i] < 1) or (switch_number_list[i] > 3):
                 raise SwitchNumberError("Switch number %s is out of range" % switch_number_list[i])
@@ -128,3 +142,47 @@ def get_pod_switches(pod_number_list,switch_number_list):
                 for switch_number in switch_number_list:
                     switches.append(all_switches[pod_number-2][switch_number])
     return switches
+
+
+def get_termsrv_limits():
+    """ retrieve the number of concurrent sessions of the terminal servers
+
+    Returns:
+        A dictionary of terminal server to its number of concurrent sessions, a terminal
+        server not in it is not limited
+    """
+    return dict(termsrv_limits)
+
+
+def get_device_vars(device_name):
+    """ retrieve the template variables of a device by specifying its name
+
+    the get_device_vars derives the pod number, device type and device number from
+    the device name (e.g. 5R3) and overrides them with the entries of device_vars
+    in raw_data for this device.
+
+    Args:
+        device_name : a string holding the device name
+
+    Returns:
+        A dictionary of variable name to value, with at least hostname, pod, 
+        device_type ('R' or 'S'), device_number and role ('router' or 'switch')
+
+    Raises:
+        DeviceNameError : when the device name does not follow the $pod$type$number scheme
+    """
+    name_list = device_name_re.findall(device_name)
+    if name_list == []:
+        raise DeviceNameError("Device name %s is not in the form of $pod$type$number" \
+                              % device_name)
+
+    variables = {"hostname"      : device_name,
+                 "pod"           : int(name_list[0][0]),
+                 "device_type"   : name_list[0][1],
+                 "device_number" : int(name_list[0][2])}
+    if variables["device_type"] == "S":
+        variables["role"] = "switch"
+    else:
+        variables["role"] = "router"
+    variables.update(device_vars.get(device_name,{}))
+    return variables
@@ -1,3 +1,14 @@
 """
 raw data to be filled here...
 """
+
+# per-device template variables, e.g. device_vars["1R1"] = {"mgmt_ip" : "10.1.1.1"}
+# a device with "transport" : "ssh" is logged in over ssh to its "mgmt_ip" (and "ssh_port"),
+# optionally with "ssh_command", "host_key_checking" (yes, accept-new or no) and "known_hosts";
+# the show commands run at the privilege of the ssh user, which must be privilege 15
+device_vars = {}
+
+# concurrent sessions a terminal server takes, e.g. termsrv_limits["termsrv1"] = 8,
+# a terminal server not listed is not limited (inwk --dry-run assumes
+# planner.ASSUMED_TERMSRV_LIMIT for it)
+termsrv_limits = {}
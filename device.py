@@ -10,6 +10,12 @@ import colorprint
 import logging
 import datetime
 import data.data_fetcher
+import cache
+import parsers
+import session_profile
+import timeouts
+import ssh_transport
+import compliance
 
 # Compiled regular expressions to interact with the device
 unprivileged_re   = re.compile("[\w\-_]+>")
@@ -25,6 +31,28 @@ comment_re        = re.compile("^(\s)*!")
 blank_re          = re.compile("^(\s)*$")
 version_re        = re.compile("version")
 paging_re         = re.compile("(-)+More(-)+")
+switch_name_re    = re.compile("S")
+replace_done_re   = re.compile("[Rr]ollback\s+[Dd]one")
+replace_failed_re = re.compile("[Rr]ollback\s+[Ff]ailed|[Ff]ailed\s+to|Invalid\s+input|%\s*[Ee]rror")
+prompt_end_re     = re.compile("[\w\-_]+#\s*$")
+no_changes_re     = re.compile("[Nn]o\s+changes\s+were\s+found")
+vlan_id_re        = re.compile("^(\d+)\s+\S+\s+(active|act/)",re.M)
+default_vlans     = ["1","1002","1003","1004","1005"]
+# Session modes tracked from the matched prompts, see Device.resync
+UNKNOWN       = "unknown"
+UNPRIVILEGED  = "unprivileged"
+PRIVILEGED    = "privileged"
+CONFIG        = "config"
+PAGING        = "paging"
+SESSION_STALE = 30
+
+# Seconds waited for the login prompt, and the least of it once the latency of the
+# device was learned on a previous run
+LOGIN_TIMEOUT       = 30
+LOGIN_TIMEOUT_FLOOR = 5
+
+copied_re         = re.compile("bytes\s+copied")
+copy_error_re     = re.compile("%\s*Error|[Ee]rror\s+opening|[Tt]imed\s+out")
 
 class UnexpectedStream(Exception):
     def __init__(self,error_string):
@@ -60,6 +88,23 @@ class SaveConfigException(Exception):
     def __init__(self):
         pass
 
+class ReplaceConfigException(Exception):
+    def __init__(self):
+        pass
+
+def config_lines(lines):
+    """strip the comment and blank lines of a configuration, ready to be sent
+
+       Args:
+           lines : an iterable of configuration lines
+
+       Returns:
+           A list of the configuration lines terminated with a return character
+    """
+    return [line.rstrip() + '\r' for line in lines \
+            if (comment_re.findall(line) == [] \
+            and blank_re.findall(line) == []) ]
+
 class Tee(object):
     """A class to duplicate an output stream to stdout/err.
 
@@ -137,9 +182,26 @@ class Device(object):
         _logch   : a file descripter for the log output in stdout 
         _execution_name : a string holding the name of the running execution of the device object
         _eof_failure : an integer which records the number of times the login encounters eof_failure
+        _reload_time : a float holding the epoch time when the last reload was requested
+        _cache   : an optional cache.CommandCache object holding recent command outputs
+        _mode    : a string holding the session mode last seen on the console
+        _mode_time : a float holding the epoch time the session mode was last seen
+        _profile : a session_profile.SessionProfile object learned on previous runs
+        _timeouts : a timeouts.LatencyTracker object deriving the expect timeouts
+        _transport : a string, "telnet" (console) or "ssh" (management ip), from the inventory
+        _ssh     : a ssh_transport.SSHConnection object when the transport is ssh
+        _rules   : an optional compliance.RuleSet object checking the saved configs
+        _dashboard : an optional dashboard.Dashboard object the console output goes to
     """
 
-    def __init__(self,device_data,execution_name="",debug=False):
+    # No per-instance dictionary, a device costs the same whatever the inventory size
+    __slots__ = ["_name","_termsrv","_port","_enabled","_debug","_proc","_tee","_outfd",
+                 "_logger","_logfh","_logch","_execution_name","_eof_failure","_reload_time",
+                 "_cache","_mode","_mode_time","_profile","_timeouts","_transport","_ssh",
+                 "_rules","_dashboard"]
+
+    def __init__(self,device_data,execution_name="",debug=False,cache=None,tracker=None,
+                 rules=None,dashboard=None):
         """Constructor of Device class
 
         Args:
@@ -147,6 +209,14 @@ class Device(object):
             debug          : enable debug messages, by default is True
             execution_name : execution name of this device object,set to be the current 
                              year-month-day-hour
+            cache          : a cache.CommandCache object shared by the devices, no caching
+                             when None
+            tracker        : a timeouts.LatencyTracker object, the shared timeouts.tracker
+                             when None
+            rules          : a compliance.RuleSet object shared by the devices, the saved
+                             configs are not checked when None
+            dashboard      : a dashboard.Dashboard object shared by the devices, which
+                             then never write to the console themselves
         """
         self._name    = device_data[0]
         self._termsrv = device_data[1][0]
@@ -160,6 +230,16 @@ class Device(object):
         self._logfh   = None
         self._logch   = None
         self._eof_failure = 0
+        self._reload_time = None
+        self._cache   = cache
+        self._mode    = UNKNOWN
+        self._mode_time = 0.0
+        self._profile = None
+        self._timeouts = tracker if tracker is not None else timeouts.tracker
+        self._transport = None
+        self._ssh     = None
+        self._rules   = rules
+        self._dashboard = dashboard
         if execution_name == "":
             self._execution_name = datetime.datetime.now().strftime("%Y-%m-%d-%H")
         else:
@@ -261,6 +341,178 @@ class Device(object):
     def eof_failure(self,eof_failure):
         self._eof_failure = eof_failure
 
+    @property
+    def reload_time(self):
+        return self._reload_time
+
+    @reload_time.setter
+    def reload_time(self,reload_time):
+        self._reload_time = reload_time
+
+    @property
+    def cache(self):
+        return self._cache
+
+    @cache.setter
+    def cache(self,cache):
+        self._cache = cache
+
+    @property
+    def rules(self):
+        return self._rules
+
+    @rules.setter
+    def rules(self,rules):
+        self._rules = rules
+
+    @property
+    def dashboard(self):
+        return self._dashboard
+
+    @dashboard.setter
+    def dashboard(self,dashboard):
+        self._dashboard = dashboard
+
+    @property
+    def timeouts(self):
+        return self._timeouts
+
+    @property
+    def transport(self):
+        if self._transport is None:
+            try:
+                self._transport = data.data_fetcher.get_device_vars(self.name).get("transport",
+                                                                                   "telnet")
+            except data.data_fetcher.DeviceNameError:
+                self._transport = "telnet"
+        return self._transport
+
+    @transport.setter
+    def transport(self,transport):
+        self._transport = transport
+
+    @property
+    def ssh(self):
+        return self._ssh
+
+    @ssh.setter
+    def ssh(self,ssh):
+        self._ssh = ssh
+
+    @property
+    def profile(self):
+        if self._profile is None:
+            self._profile = session_profile.SessionProfile(self.name)
+            # the expect timeouts start from what the previous runs learned
+            self.timeouts.seed(self.name,self._profile.get("timeouts") or {})
+        return self._profile
+
+    def save_profile(self):
+        """save the session profile along with the latency stats of the device"""
+        learned = self.timeouts.export(self.name)
+        if learned != {}:
+            self.profile.update("timeouts",learned)
+        if self._profile is not None:
+            self._profile.save()
+
+    def is_switch(self):
+        """return True for a switch, as learned from show version or guessed from the name"""
+        if self.profile.get("is_switch") is not None:
+            return self.profile.get("is_switch")
+        return switch_name_re.findall(self.name) != []
+
+    def login_timeout(self):
+        """return the timeout of the login prompt expect
+
+           Until the tracker has samples of its own, the latency the session profile
+           learned on the previous runs shortens the default LOGIN_TIMEOUT.
+        """
+        default = LOGIN_TIMEOUT
+        latency = self.profile.get("latency")
+        if latency is not None and self.timeouts.enabled:
+            default = min(LOGIN_TIMEOUT,max(LOGIN_TIMEOUT_FLOOR,timeouts.FACTOR * latency))
+        return self.timeouts.timeout(self.name,"login",default,floor=2)
+
+    def learn_login(self,start):
+        """record a successful login in the session profile"""
+        self.profile.observe_latency(time.time() - start)
+        self.timeouts.observe(self.name,"login",time.time() - start)
+        self.profile.update("logins",self.profile.get("logins") + 1)
+        self.profile.save()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self,mode):
+        self._mode      = mode
+        self._mode_time = time.time()
+
+    def track(self):
+        """update the session mode from the prompt matched by the last expect"""
+        after = self.proc.after if isinstance(self.proc.after,str) else ""
+        if config_re.findall(after) != []:
+            self.mode = CONFIG
+        elif privileged_re.findall(after) != []:
+            self.mode = PRIVILEGED
+        elif unprivileged_re.findall(after) != []:
+            self.mode = UNPRIVILEGED
+        elif paging_re.findall(after) != []:
+            self.mode = PAGING
+        else:
+            self.mode = UNKNOWN
+
+    def resync(self,force=False):
+        """make sure the session sits at the privileged prompt
+
+           The return character round trip is skipped when the last prompt seen on
+           the console was privileged less than SESSION_STALE seconds ago.
+
+           Args:
+               force : a boolean to resync even if the session mode is known
+        """
+        if force == False and self.mode == PRIVILEGED and \
+                time.time() - self._mode_time < SESSION_STALE:
+            self.logger.debug("Session is known to be in privileged mode,skipping resync..")
+            return
+        self.logger.debug("Sending return character to get a new prompt..")
+        start = self.timeouts.clock()
+        self.proc.send("\r")
+        self.proc.expect(privileged_re,timeout=self.timeouts.timeout(self.name,"prompt",30))
+        self.timeouts.observe(self.name,"prompt",self.timeouts.clock() - start)
+        self.mode = PRIVILEGED
+        self.logger.debug("We are now in privileged mode")
+
+    def invalidate_cache(self):
+        """drop the cached command outputs of this device"""
+        if self.cache is not None:
+            self.cache.invalidate(self.name)
+
+    def error_print(self,s="error is found below"):
+        """print an error banner, or hand the message to the dashboard when there is one"""
+        if self.dashboard is None:
+            colorprint.error_print(s)
+        elif s != "error is found below":
+            self.dashboard.message(self.name,s)
+
+    def check_compliance(self,config):
+        """check a config of this device against the rules and write its report
+
+           The report is written to compliance/$execution_name/$devicename.txt.
+
+           Returns:
+               A list of compliance.Violation tuples, empty when there are no rules
+        """
+        if self.rules is None:
+            return []
+        violations = self.rules.check(config)
+        compliance.write_report(self.name,violations,self.execution_name)
+        if violations != []:
+            self.logger.warning("%s compliance violations, refer compliance/%s/%s.txt" \
+                                % (len(violations),self.execution_name,self.name))
+        return violations
+
 
     def login(self,username,password,attempt=2,interval=1,force=False):
         """spawn a telnet session to a given device
@@ -289,8 +541,22 @@ class Device(object):
                 KeyboardInterrupt : ctrl-c is received during the execution  
         """
         try:
-            self.logger.info("Attempt to spawn telnet session to %s" % self.name)
-            self.proc = pexpect.spawn('telnet %s %s' % (self.termsrv,self.port))
+            if self.transport == "ssh":
+                device_vars = data.data_fetcher.get_device_vars(self.name)
+                self.logger.info("Attempt to open ssh session to %s" % self.name)
+                self.ssh = ssh_transport.SSHConnection(device_vars["mgmt_ip"],username,password,
+                                                       device_vars.get("ssh_port",22),
+                                                       ssh_command=device_vars.get("ssh_command",
+                                                                                   "ssh"),
+                                                       host_key_checking=device_vars.get(
+                                                           "host_key_checking",
+                                                           ssh_transport.HOST_KEY_CHECKING),
+                                                       known_hosts=device_vars.get("known_hosts"))
+                self.ssh.connect()
+                self.proc = self.ssh.shell()
+            else:
+                self.logger.info("Attempt to spawn telnet session to %s" % self.name)
+                self.proc = pexpect.spawn('telnet %s %s' % (self.termsrv,self.port))
 
             stdout_log_path = "logs/" + self.execution_name + "/" + self.name + ".stdout"
 
@@ -301,36 +567,44 @@ class Device(object):
                 self.outfd = open(stdout_log_path, "w") 
                 self.proc.logfile_read = self.outfd
             
-            self.proc.expect("username")
-            self.logger.debug("Get username prompt,sending username %s" % username)
+            if self.ssh is None:
+                self.proc.expect("username")
+                self.logger.debug("Get username prompt,sending username %s" % username)
             
-            self.proc.send(username + "\r")
-            self.logger.debug("Get password prompt,sending password ...")
-            self.proc.expect("password")
-            self.proc.send(password + "\r")
+                self.proc.send(username + "\r")
+                self.logger.debug("Get password prompt,sending password ...")
+                self.proc.expect("password")
+                self.proc.send(password + "\r")
             
-            ## Workaround for the banner messages
-            self.logger.debug("Sending return character to skip over the banner message")
-            time.sleep(0.2)
-            self.proc.send("\r")
+            ## Workaround for the banner messages, not needed for a device we logged in before
+            if self.ssh is None and (self.profile.known == False or self.profile.get("controller")):
+                self.logger.debug("Sending return character to skip over the banner message")
+                time.sleep(0.2)
+                self.proc.send("\r")
 
             attempt_counter  = 1
             page_counter     = 0
             
             while (attempt > 0):
+                start = time.time()
                 self.proc.send("\r")
                 index = self.proc.expect([unprivileged_re,privileged_re,\
                                     config_re,initial_dialog_re,auto_install_re,\
-                                    controller_re,paging_re,pexpect.TIMEOUT])
+                                    controller_re,paging_re,pexpect.TIMEOUT],\
+                                    timeout=self.login_timeout())
 
                 if index == 0:
                     self.logger.info("We are now in the unprivileged mode")
                     self.enabled = False
+                    self.mode = UNPRIVILEGED
+                    self.learn_login(start)
                     return 0;
 
                 elif index == 1:
                     self.logger.info("We are now in the privileged mode")
                     self.enabled = True
+                    self.mode = PRIVILEGED
+                    self.learn_login(start)
                     return 0;
 
                 elif index == 2:
@@ -340,6 +614,8 @@ class Device(object):
                     self.proc.expect(privileged_re)
                     self.logger.info("We are now in the configuration mode")
                     self.enabled = True
+                    self.mode = PRIVILEGED
+                    self.learn_login(start)
                     return 0;
 
                 elif index == 3:
@@ -351,6 +627,8 @@ class Device(object):
                     if index2 == 0:
                         self.logger.info("We are now in the unprivileged mode")
                         self.enabled = False
+                        self.mode = UNPRIVILEGED
+                        self.learn_login(start)
                         return 0
                     elif index2 == 1:
                         self.logger.info("We are asked to confirm terminating the auto-install,sending yes..")
@@ -373,6 +651,7 @@ class Device(object):
 
                 elif index == 5:
                     self.logger.info("We are in the wireless controller prompt,sending control-character to exit")
+                    self.profile.update("controller",True)
                     self.proc.sendcontrol('^')
                     self.proc.send('x')
                     self.proc.expect(privileged_re)
@@ -401,6 +680,7 @@ class Device(object):
             raise UnexpectedStream("Expected Stream was encountered when attempting to login")
 
         except pexpect.EOF:
+            self.close_ssh()
             if force:
                 if self.eof_failure < 2:              
                     if self.debug == True:
@@ -424,10 +704,12 @@ class Device(object):
                 raise LoginException
 
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.close_ssh()
+            self.error_print()
             self.logger.error("Unable to login to device %s, refer %s.stdout for details" \
                                 % (self.name, self.name))
             raise LoginException
@@ -453,6 +735,13 @@ class Device(object):
                 KeyboardInterrupt : ctrl-c is received during execution 
         """
         try :
+            learned = self.profile.get("enable_passwd")
+            if learned is not None and learned in enable_passwd:
+                self.logger.debug("Trying the enable password learned on previous runs first")
+                enable_passwd = [learned] + [passwd for passwd in enable_passwd if passwd != learned]
+            sent_passwd = None
+            sent_enable = False
+
             self.logger.debug("sending return character to get a new prompt")
             self.proc.send("\r")
     
@@ -464,7 +753,9 @@ class Device(object):
                 if index == 0:
                     self.logger.debug("We are in unprivileged mode, sending enable command...")
                     self.proc.send("enable" + "\r")
-                    time.sleep(0.5)
+                    sent_enable = True
+                    if learned is None:
+                        time.sleep(0.5)
                     continue;
                 elif index == 1:
                     if attempt_counter > 1:
@@ -474,6 +765,10 @@ class Device(object):
                     self.logger.debug("We are prompted to enter enable password,"\
                                        "sending commonly used password %s"\
                                       % enable_passwd[passwd_counter] )
+                    if sent_passwd is not None and sent_passwd == learned:
+                        self.logger.debug("Learned enable password was rejected,falling back")
+                        self.profile.forget("enable_passwd")
+                    sent_passwd = enable_passwd[passwd_counter]
                     self.proc.send(enable_passwd[passwd_counter] + "\r")
                     attempt_counter = attempt_counter + 1
                     if attempt_counter > passwd_counter + 1:
@@ -482,6 +777,12 @@ class Device(object):
                 elif index == 2:
                     self.logger.info("We successfully enter into privileged mode")
                     self.enabled = True
+                    self.mode = PRIVILEGED
+                    if sent_passwd is not None:
+                        self.profile.update("enable_passwd",sent_passwd)
+                    elif sent_enable:
+                        self.profile.update("enable_passwd","")
+                    self.profile.save()
                     if disable_paging:
                         self.logger.debug("Sending terminal length 0 command to disable paging...")
                         self.proc.send("terminal length 0\r")
@@ -502,24 +803,31 @@ class Device(object):
             raise UnexpectedStream("Expected Stream was encountered when attempting to login")
 
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.error_print()
             self.logger.error("Unable to get privileged on device %s, refer %s.stdout for details" \
                                 % (self.name, self.name))
             raise EnableException
 
-    def reset(self,erase_vlan=False):
+    def reset(self,erase_vlan=False,mode="reload",baseline="flash:baseline.cfg"):
         """reset a device to its factory default
     
            Reset a router or switch to its factory default by clearing up the startup-config
            (optionally the vlan.dat file) and reloading the device. It assumes the telnet 
-           session is in a priviledged status.
+           session is in a priviledged status. With mode set to "replace", the baseline
+           configuration stored on the device is restored in place by replace_config and
+           the reload path is only taken when the replace fails. reload_time is only set
+           when the device was reloaded, the console session is left attached for
+           the watcher.ReloadWatcher of the run to follow the boot.
    
            Args:
                self       : the device object
                erase_vlan : a boolean indicating whether or not to remove the vlan.dat
+               mode       : a string, either "reload" or "replace"
+               baseline   : a string holding the baseline config url on the device
 
            Returns:
                Upon succussful reset, code 0 will be returned to indicate a clear status.
@@ -528,14 +836,19 @@ class Device(object):
                ResetException    : factory default reset on this device failed
                KeyboardInterrupt : ctrl-c received
         """ 
+        self.invalidate_cache()
+        self.reload_time = None
+        if mode == "replace":
+            try:
+                return self.replace_config(baseline)
+            except ReplaceConfigException:
+                self.logger.warning("Configure replace failed on %s,falling back to reload" \
+                                    % self.name)
+
         try :
-            self.logger.debug("Sending return character to get a new prompt..")       
-            self.proc.send("\r")
-            self.proc.expect(privileged_re)
-            self.logger.debug("We are now in privileged mode")
+            self.resync()
 
-            switch_name_re = re.compile("S")
-            if switch_name_re.findall(self.name) != [] :
+            if self.is_switch():
                 erase_vlan = True
 
             if erase_vlan:
@@ -572,31 +885,158 @@ class Device(object):
                 self.proc.send("\r")
     
             self.proc.expect("Reload\srequested")
+            self.reload_time = time.time()
+            self.mode = UNKNOWN
             self.logger.info("Reload request has been submitted to the device")
             return 0
 
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.error_print()
             self.logger.error("Unable to reset the device %s, refer %s.stdout for details" \
                                 % (self.name, self.name))
             raise ResetException
         
 
-    def send_cmd(self,command,max_performance=False,interval=5):
+    def save_baseline(self,baseline="flash:baseline.cfg"):
+        """store the current running-config on the device as the reset baseline
+    
+           save_baseline copies the running-config to the baseline url so that a later
+           reset(mode="replace") can restore it in place. It assumes the telnet session 
+           is in a priviledged status.
+   
+           Args:
+               self     : the device object
+               baseline : a string holding the baseline config url on the device
+
+           Returns:
+               Upon successfully storing the baseline, code 0 will be returned.
+
+           Raises:
+               ReplaceConfigException : failure to copy the running-config
+               KeyboardInterrupt      : ctrl-c received
+        """
+        try:
+            self.resync()
+
+            self.logger.info("Copying running-config to %s" % baseline)
+            self.proc.send("copy running-config %s\r" % baseline)
+            while True:
+                index = self.proc.expect(["\?",confirm_re,privileged_re])
+                if index == 2:
+                    self.mode = PRIVILEGED
+                    break
+                self.logger.debug("Asked to confirm the destination,sending return..")
+                self.proc.send("\r")
+            return 0
+
+        except KeyboardInterrupt:
+            self.error_print("Keyboard Interrup has been received..Exiting..")
+            raise KeyboardInterrupt    
+        except: 
+            self.mode = UNKNOWN
+            self.error_print()
+            self.logger.error("Unable to store baseline %s on device %s," \
+                              "refer %s.stdout for details" \
+                                % (baseline,self.name, self.name))
+            raise ReplaceConfigException
+
+    def replace_config(self,baseline="flash:baseline.cfg",timeout=120):
+        """restore the baseline configuration in place without reloading the device
+    
+           replace_config removes the non-default vlans on switches, runs configure 
+           replace against the baseline and verifies that the running-config no longer
+           differs from it. The startup-config is overwritten with the baseline so that 
+           a later reboot comes back in the same state. It assumes the telnet session 
+           is in a priviledged status.
+   
+           Args:
+               self     : the device object
+               baseline : a string holding the baseline config url on the device
+               timeout  : an integer holding the seconds to wait for the replace to finish
+
+           Returns:
+               Upon successfully restoring the baseline, code 0 will be returned.
+
+           Raises:
+               ReplaceConfigException : the replace failed or the result differs from the baseline
+               KeyboardInterrupt      : ctrl-c received
+        """
+        try:
+            self.invalidate_cache()
+            if self.is_switch():
+                vlans = [vlan for vlan,state in vlan_id_re.findall( \
+                            self.send_cmd("show vlan brief",max_performance=True)) \
+                         if vlan not in default_vlans]
+                if vlans != []:
+                    self.logger.info("Removing vlans %s before replacing the config" \
+                                     % ",".join(vlans))
+                    self.proc.send("configure terminal\r")
+                    self.proc.expect(config_re)
+                    for vlan in vlans:
+                        self.proc.send("no vlan %s\r" % vlan)
+                        self.proc.expect(config_re)
+                    self.proc.send("end\r")
+                    self.proc.expect(privileged_re)
+
+            self.logger.info("Sending configure replace %s..." % baseline)
+            self.proc.send("configure replace %s force\r" % baseline)
+            self.proc.expect(privileged_re,timeout=timeout)
+            replace_output = self.proc.before
+            if replace_failed_re.findall(replace_output) != [] \
+                    or replace_done_re.findall(replace_output) == []:
+                raise UnexpectedStream("configure replace did not complete")
+            self.logger.info("Configure replace is done, verifying against the baseline")
+
+            diff = self.send_cmd("show archive config differences %s system:running-config" \
+                                 % baseline,max_performance=True)
+            if no_changes_re.findall(diff) == []:
+                raise UnexpectedStream("running-config still differs from the baseline")
+
+            self.proc.send("copy running-config startup-config\r")
+            while True:
+                index = self.proc.expect(["\?",confirm_re,privileged_re])
+                if index == 2:
+                    self.mode = PRIVILEGED
+                    break
+                self.proc.send("\r")
+            self.logger.info("Baseline %s has been restored without a reload" % baseline)
+            return 0
+
+        except KeyboardInterrupt:
+            self.error_print("Keyboard Interrup has been received..Exiting..")
+            raise KeyboardInterrupt    
+        except: 
+            self.mode = UNKNOWN
+            self.error_print()
+            self.logger.error("Unable to replace the config with %s on device %s," \
+                              "refer %s.stdout for details" \
+                                % (baseline,self.name, self.name))
+            raise ReplaceConfigException
+
+    def send_cmd(self,command,max_performance=False,interval=None):
         """execute a command on a device and capture its output
     
            send_cmd assumes the telnet session is an enabled status. when max_performance is 
            True, it captures the start of command out to the first word which matches the 
            privileged_re. This sometimes may not be the entire command output (buggy output
            with "show version" on a ISR router). By diabling max_performance, it captures all 
-           the command output within the given amount of interval time.
+           the command output within the given amount of interval time. When the device has
+           a cache, show commands are served from it and any other command invalidates it.
+           A max_performance capture may be truncated, so it is never stored in the cache.
+           Unless interval is given, the wait for the first prompt and the idle interval
+           are derived from the latency observed for this command on the device (see 
+           timeouts.py), both default to 5 seconds until enough latency samples exist.
+           The latency is learned per normalized command, as a show run takes much 
+           longer than a show version on the same device.
    
            Args:
                self       : the device object
                command    : a string holding the command to be executed
+               interval   : a float holding the idle seconds which end the output capture
 
            Returns:
                the command output is returned.
@@ -606,48 +1046,182 @@ class Device(object):
                KeyboardInterrupt   : ctrl-c received
         """  
         try:
+            if self.cache is not None:
+                if cache.is_cacheable(command):
+                    cmd_output = self.cache.get(self.name,command)
+                    if cmd_output is not None:
+                        self.logger.debug("Serving command %s from the cache" % command)
+                        return cmd_output
+                else:
+                    self.invalidate_cache()
+
+            if self.ssh is not None and cache.is_cacheable(command):
+                self.logger.info("Sending command %s on its own ssh channel..." % command)
+                cmd_output = self.ssh.run(command)
+                if self.cache is not None:
+                    self.cache.put(self.name,command,cmd_output)
+                return cmd_output
+
             cmd_output = ""
-            self.logger.debug("Sending return character to get a new prompt..")  
-            self.proc.send("\r")
-            self.proc.expect(privileged_re)   
-            self.logger.debug("We are now in privileged mode")
+            self.resync()
             
+            operation = "command " + cache.normalize(command)
+            start = self.timeouts.clock()
             self.proc.send(command + "\r")
+            self.mode = UNKNOWN
             self.logger.info("Sending command %s..." % command)     
     
             if max_performance:
                 self.logger.debug("Max_performace is turned on, command output" \
                                   "capture may not be accurate")  
-                self.proc.expect(privileged_re)
+                self.proc.expect(privileged_re,timeout=self.timeouts.timeout(self.name,\
+                                 operation,30,floor=1,ceiling=300))
+                self.timeouts.observe(self.name,operation,self.timeouts.clock() - start)
                 cmd_output = self.proc.before
+                self.track()
             else:
-                while (self.proc.expect([privileged_re,pexpect.TIMEOUT],timeout=interval) != 1) :
+                if interval is None:
+                    timeout  = self.timeouts.timeout(self.name,operation,5,floor=1,ceiling=300)
+                    interval = self.timeouts.idle(self.name,operation,5)
+                else:
+                    timeout  = interval
+                while (self.proc.expect([privileged_re,pexpect.TIMEOUT],timeout=timeout) != 1) :
+                    if self.mode == UNKNOWN:
+                        self.timeouts.observe(self.name,operation,self.timeouts.clock() - start)
                     cmd_output = cmd_output + self.proc.before
+                    self.track()
+                    timeout = interval
     
             self.logger.info("Finished command execution and get privileged mode prompt again..")
+            if self.cache is not None and cache.is_cacheable(command) \
+                                      and max_performance == False:
+                self.cache.put(self.name,command,cmd_output)
             return cmd_output
 
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.error_print()
             self.logger.error("Unable to execute command %s on device %s," \
                               "refer %s.stdout for details" \
                                 % (command,self.name, self.name))
             raise ExecuteCMDException
 
-    def push_config(self,configfile=""):
+    def send_cmds(self,commands,max_performance=False):
+        """execute several show commands on a device and capture their outputs
+    
+           Over ssh every command runs on its own channel of the same connection, all
+           of them in parallel. Over the console they run one after the other with
+           send_cmd.
+   
+           Args:
+               self     : the device object
+               commands : a list of strings holding the commands to be executed
+
+           Returns:
+               the list of the command outputs, in the order of the commands.
+
+           Raises:
+               ExecuteCMDException : failure to execute one of the commands on this device
+               KeyboardInterrupt   : ctrl-c received
+        """
+        if self.ssh is None:
+            return [self.send_cmd(command,max_performance) for command in commands]
+        try:
+            self.logger.info("Sending commands %s on parallel ssh channels..." \
+                             % ",".join(commands))
+            return self.ssh.run_many(commands)
+        except KeyboardInterrupt:
+            self.error_print("Keyboard Interrup has been received..Exiting..")
+            raise KeyboardInterrupt    
+        except: 
+            self.error_print()
+            self.logger.error("Unable to execute commands %s on device %s," \
+                              "refer %s.stdout for details" \
+                                % (",".join(commands),self.name, self.name))
+            raise ExecuteCMDException
+
+    def parse_cmd(self,command,timeout=30):
+        """execute a show command on a device and parse its output into records
+    
+           parse_cmd streams the command output through the compiled parser of the
+           command (see parsers.py) chunk by chunk while it arrives, and stops reading 
+           as soon as the privileged prompt ends the output. It assumes the telnet 
+           session is in an enabled status. The output is cached in the form send_cmd
+           returns it.
+   
+           Args:
+               self    : the device object
+               command : a string holding a show command supported by parsers.py
+               timeout : an integer holding the seconds to wait for each chunk
+
+           Returns:
+               a list of records (namedtuples) parsed from the command output.
+
+           Raises:
+               ExecuteCMDException : failure to execute or parse the given cmd on this device
+               KeyboardInterrupt   : ctrl-c received
+        """  
+        try:
+            template = parsers.get_template(command)
+            if self.cache is not None:
+                cmd_output = self.cache.get(self.name,command)
+                if cmd_output is not None:
+                    self.logger.debug("Parsing command %s from the cache" % command)
+                    return template.parse(cmd_output)
+
+            self.resync()
+            self.proc.send(command + "\r")
+            self.logger.info("Sending command %s and parsing its output..." % command)     
+
+            stream = template.stream()
+            chunks = []
+            while prompt_end_re.search(stream.partial) is None:
+                chunk = self.proc.read_nonblocking(4096,timeout)
+                chunks.append(chunk)
+                stream.feed(chunk)
+
+            self.mode = PRIVILEGED
+            records = stream.close()
+            if template is parsers.show_version and records != [] and records[0].model:
+                self.profile.update("is_switch",records[0].model.startswith("WS-C") \
+                                    or "atalyst" in records[0].model)
+            self.logger.info("Parsed %s records from command %s" % (len(records),command))
+            if self.cache is not None:
+                # stored like send_cmd does, up to and without the closing prompt
+                self.cache.put(self.name,command,prompt_end_re.sub("","".join(chunks)))
+            return records
+
+        except KeyboardInterrupt:
+            self.error_print("Keyboard Interrup has been received..Exiting..")
+            raise KeyboardInterrupt    
+        except: 
+            self.mode = UNKNOWN
+            self.error_print()
+            self.logger.error("Unable to parse command %s on device %s," \
+                              "refer %s.stdout for details" \
+                                % (command,self.name, self.name))
+            raise ExecuteCMDException
+
+    def push_config(self,configfile="",lines=None,transfer="console",tftp_server=None):
         """push a prepared a configuration file to a device
     
            push_config pushes a prepared config file to a device. It assumes a priviledged 
            telnet session is present. By default,It will search for a config file with 
            filename of $devicename.cfg under the config directory if no configfile is 
-           specified.
+           specified. When lines are given, e.g. rendered by templating.py, they are
+           pushed as they are and no file is read. With transfer set to "tftp", the 
+           config is published on the tftp_server and the device copies it into its
+           running-config, the console only carries the copy command.
    
            Args:
-               self       : the device object
-               configfile : a string holding the full path of configuration file
+               self        : the device object
+               configfile  : a string holding the full path of configuration file
+               lines       : a list of filtered configuration lines as returned by config_lines
+               transfer    : a string, either "console" or "tftp"
+               tftp_server : a tftp.TFTPServer object reachable from the device
 
            Returns:
                Upon successfully pushing the config, code 0 will be returned.
@@ -657,26 +1231,36 @@ class Device(object):
                KeyboardInterrupt   : ctrl-c received
         """
         try:  
-            self.proc.send("\r")
-            self.logger.debug("Sending return character to get a new prompt..") 
-            self.proc.expect(privileged_re)
-            self.logger.debug("We are now in privileged mode")
-
-            if configfile == "":
-                configfile = "config/" + self.name + ".cfg"
+            self.invalidate_cache()
+            self.resync()
 
-            if os.path.isfile(configfile) == False:
-                raise NoConfigFile
-
-            lines_to_send = []
-            with open(configfile) as f:
-                lines_to_send = [line.rstrip() + '\r' for line in f \
-                                 if (comment_re.findall(line) == [] \
-                                 and blank_re.findall(line) == []) ]
+            if lines is not None:
+                lines_to_send = lines
+            else:
+                if configfile == "":
+                    configfile = "config/" + self.name + ".cfg"
+
+                if os.path.isfile(configfile) == False:
+                    raise NoConfigFile
+
+                with open(configfile) as f:
+                    lines_to_send = config_lines(f)
+
+            if transfer == "tftp":
+                filename = self.execution_name + "/" + self.name + ".cfg"
+                tftp_server.publish(filename,"\n".join([line.rstrip("\r") \
+                                                       for line in lines_to_send]) + "\nend\n")
+                try:
+                    self.tftp_copy(tftp_server.url(filename),"running-config")
+                finally:
+                    tftp_server.unpublish(filename)
+                self.logger.info("Config has been copied to running-config over tftp")
+                return 0
             
             self.proc.send("configure terminal\r")
             self.logger.debug("Sending configure terminal to get into config mode..") 
             self.proc.expect(config_re)
+            self.mode = CONFIG
             self.logger.info("We are now in global configuration mode")
         
             for line in lines_to_send:
@@ -688,37 +1272,69 @@ class Device(object):
                     continue
                 else:
                     self.logger.debug("Getting privileged mode prompt")
+                    self.mode = PRIVILEGED
                     return 0
         
             self.logger.debug("All config lines have been pushed..")
             self.logger.debug("Sending end to exit out of config mode..") 
             self.proc.send("end\r")
             self.proc.expect(privileged_re)
+            self.mode = PRIVILEGED
             self.logger.debug("We are now in privileged mode")
             return 0
 
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.error_print()
             self.logger.error("Unable to push configfile %s on device %s," \
                               "refer %s.stdout for details" \
                                 % (configfile,self.name, self.name))
             raise PushConfigException
 
-    def save_config(self):
-        """save configs
-        To be documented.
+    def save_config(self,transfer="console",tftp_server=None,timeout=10):
+        """save the running-config of a device under config_archive/$execution_name
     
+           save_config archives the running-config as config_archive/$execution_name/
+           $devicename.cfg. By default the output of show run is captured over the 
+           console. With transfer set to "tftp", the device copies its running-config
+           to the tftp_server, which writes it straight into the config archive.
+           The archived config is checked against the compliance rules of the device.
+
+           Args:
+               self        : the device object
+               transfer    : a string, either "console" or "tftp"
+               tftp_server : a tftp.TFTPServer object reachable from the device whose
+                             write_root is the config archive
+               timeout     : an integer holding the seconds to wait for the tftp server
+                             to store the received config
+
+           Raises:
+               SaveConfigException : fails to save the config of the device
+               KeyboardInterrupt   : ctrl-c received
         """
         try:
             if os.path.isdir("config_archive/" + self.execution_name) == False:
                 os.makedirs("config_archive/" + self.execution_name)
     
-            self.proc.send("\r")
-            self.logger.debug("Sending return character to get a new prompt..") 
-            self.proc.expect(privileged_re)
+            self.resync()
+
+            if transfer == "tftp":
+                filename = self.execution_name + "/" + self.name + ".cfg"
+                self.tftp_copy("running-config",tftp_server.url(filename))
+                deadline = time.time() + timeout
+                path = tftp_server.received(filename)
+                while path is None:
+                    if time.time() > deadline:
+                        raise UnexpectedStream("tftp server did not store %s" % filename)
+                    time.sleep(0.1)
+                    path = tftp_server.received(filename)
+                self.logger.info("Running-config has been archived over tftp")
+                with open(path) as fd:
+                    self.check_compliance(fd.read())
+                return 0
     
             running_config = self.send_cmd("show run",max_performance=True)
             
@@ -738,23 +1354,95 @@ class Device(object):
             fd = open(config_archive_path,"w")
             fd.write(running_config)
             fd.close()
+            self.check_compliance(running_config)
         
         except KeyboardInterrupt:
-            colorprint.error_print("Keyboard Interrup has been received..Exiting..")
+            self.error_print("Keyboard Interrup has been received..Exiting..")
             raise KeyboardInterrupt    
         except: 
-            colorprint.error_print()
+            self.mode = UNKNOWN
+            self.error_print()
             self.logger.error("Unable to save configfile for device %s," \
                               "refer %s.stdout for details" \
                                 % (self.name, self.name))
             raise SaveConfigException
                
 
+    def reattach(self,username,password):
+        """re-spawn the console session of a device without walking the prompts
+
+           reattach is used when the terminal server drops the console session while
+           the device is rebooting. The dropped session is closed first, then the new
+           one only authenticates against the terminal server and leaves the boot
+           output to be consumed by the caller (see watcher.py).
+
+           Args:
+               self     : the device object
+               username : a string holding the username of telnet session
+               password : a string holding the password of telnet session
+
+           Returns:
+               the new pexpect.spawn object
+
+           Raises:
+               pexpect.EOF, pexpect.TIMEOUT : the terminal server could not be reached
+        """
+        self.logger.info("Re-attaching the console session to %s" % self.name)
+        self.mode = UNKNOWN
+        logfile_read = None
+        if self.proc is not None:
+            logfile_read = self.proc.logfile_read
+            self.proc.logfile_read = None
+            try:
+                self.proc.close(True)
+            except:
+                # the session is dropped anyway
+                pass
+        self.proc = pexpect.spawn('telnet %s %s' % (self.termsrv,self.port))
+        self.proc.logfile_read = logfile_read
+        self.proc.expect("username")
+        self.proc.send(username + "\r")
+        self.proc.expect("password")
+        self.proc.send(password + "\r")
+        return self.proc
+
+    def tftp_copy(self,source,destination,timeout=300):
+        """run a copy command between the device and a tftp url
+    
+           tftp_copy accepts the default answers the device prompts for (remote host,
+           filenames) and checks the copy reported its bytes copied. It assumes the 
+           telnet session is in a priviledged status.
+   
+           Args:
+               self        : the device object
+               source      : a string holding the source, e.g. running-config or a tftp url
+               destination : a string holding the destination
+               timeout     : an integer holding the seconds to wait for the copy to finish
+
+           Raises:
+               UnexpectedStream : the device reported an error or no bytes copied
+        """
+        self.logger.info("Sending copy %s %s..." % (source,destination))
+        self.proc.send("copy %s %s\r" % (source,destination))
+        copy_output = ""
+        while True:
+            index = self.proc.expect(["\?",confirm_re,privileged_re],timeout=timeout)
+            copy_output = copy_output + self.proc.before
+            if index == 2:
+                break
+            self.logger.debug("Asked to confirm the copy,sending return..")
+            self.proc.send("\r")
+        self.mode = PRIVILEGED
+        if copy_error_re.findall(copy_output) != [] or copied_re.findall(copy_output) == []:
+            raise UnexpectedStream("copy %s %s failed" % (source,destination))
+        return 0
+
     def disconnect(self,force=False):
         """terminate an exsiting telnet session.
      
            disconnect method terminate the telnet process with SIGHUP and SIGINT,
-           or with SIGKILL when the force is set to be True.
+           or with SIGKILL when the force is set to be True. The ssh connection of 
+           the device, if any, is closed as well.
    
            Args:
                force : boolean to indicate whether force to terminate the process
@@ -762,8 +1450,16 @@ class Device(object):
            Returns:
                True when telnet process is successfully terminated, otherwise false.
         """  
+        self.mode = UNKNOWN
+        self.close_ssh()
         return self.proc.terminate(force)
 
+    def close_ssh(self):
+        """tear down the ssh control master of the device, if any"""
+        if self.ssh is not None:
+            self.ssh.close()
+            self.ssh = None
+
     def pre_process(self,s="",log_filename=""):
 
         ## printing to stdout indicate starting execution sequence of the device
@@ -771,7 +1467,8 @@ class Device(object):
             start_string = "STARTING EXECUTION SEQUENCE FOR %s" % self.name
         else:
             start_string = s
-        colorprint.start_print(start_string)
+        if self.dashboard is None:
+            colorprint.start_print(start_string)
 
         # Create the logging directory
         if os.path.isdir("logs/" + self.execution_name) == False:
@@ -788,13 +1485,19 @@ class Device(object):
         self.logfh.setFormatter(formatter)
         self.logger.addHandler(self.logfh)
 
-        if self.debug == False:
+        if self.dashboard is not None:
+            self.logch = self.dashboard.handler(self.name)
+            self.logger.addHandler(self.logch)
+        elif self.debug == False:
             self.logch = logging.StreamHandler()
             self.logch.setLevel(logging.DEBUG)
             self.logch.setFormatter(formatter)
             self.logger.addHandler(self.logch)
 
     def post_process(self,s=""):
+        """close the output files of a device, print its end banner and release it"""
+
+        self.save_profile()
 
         if self.debug == True:
             self.tee.close()
@@ -802,14 +1505,55 @@ class Device(object):
             self.outfd.close()
 
         ## printing to stdout indicate ending execution sequence of the device
-        if self.debug == True:
+        if self.debug == True and self.dashboard is None:
             if s == "":
                 end_string = "ENDING EXECUTION SEQUENCE FOR %s" % self.name
             else:
                 end_string = s
             colorprint.end_print(end_string)
-            time.sleep(0.2)
-            os.system("clear")
+
+        self.release()
+
+    def release(self):
+        """drop the resources a device holds once it is done with
+
+           The handlers are closed and the logger is removed from the logging manager,
+           which would otherwise keep it for the life of the process. The console
+           session, its buffers and the output files are dropped as well, so that a
+           long running process does not grow with every device it touches. release
+           is called by post_process and may be called again, e.g. after a failed stage.
+        """
+        self.save_profile()
+        self._profile = None
+        if self._proc is not None:
+            self._proc.logfile_read = None
+            try:
+                self._proc.close(True)
+            except:
+                # the session is dropped anyway
+                pass
+            self._proc = None
+        self.close_ssh()
+        if self._tee is not None and self._tee.closed == False:
+            self._tee.close()
+        self._tee = None
+        if self._outfd is not None:
+            self._outfd.close()
+            self._outfd = None
+        if self._logger is not None:
+            for handler in list(self._logger.handlers):
+                self._logger.removeHandler(handler)
+                handler.close()
+            logging._acquireLock()
+            try:
+                name = self._logger.name
+                if logging.Logger.manager.loggerDict.get(name) is self._logger:
+                    del logging.Logger.manager.loggerDict[name]
+            finally:
+                logging._releaseLock()
+            self._logger = None
+        self._logfh = None
+        self._logch = None
  
     def clear_line(self):
         
@@ -860,7 +1604,3 @@ class Device(object):
             self.logger.info("clear line is successfully performed")
         except:
             self.logger.info("clear line fails")
-
-    def __del__(self):
-        pass
-
@@ -0,0 +1,381 @@
+#!/usr/bin/python
+
+import re
+import os
+import glob
+import json
+import time
+import array
+import operator
+import itertools
+from collections import Counter
+import parsers
+
+FACTS_DIR = "facts"
+
+# Column types of the fact store
+INT      = "l"
+FLOAT    = "d"
+CATEGORY = "category"
+
+# Columns collected for every device, see collect()
+SCHEMA = [("device",CATEGORY),
+          ("pod",INT),
+          ("model",CATEGORY),
+          ("version",CATEGORY),
+          ("uptime",INT),
+          ("interfaces_up",INT),
+          ("interfaces_down",INT),
+          ("interfaces_admin_down",INT),
+          ("down_interfaces",CATEGORY),
+          ("vlans",CATEGORY),
+          ("collected",FLOAT)]
+
+# Compiled regular expressions to turn the parsed facts into columns
+pod_re          = re.compile("^(\d+)")
+version_num_re  = re.compile("\d+")
+uptime_part_re  = re.compile("(\d+)\s+(year|week|day|hour|minute|second)")
+uptime_seconds  = {"year" : 31536000,"week" : 604800,"day" : 86400,"hour" : 3600,
+                   "minute" : 60,"second" : 1}
+
+comparators = {"<" : operator.lt,"<=" : operator.le,"==" : operator.eq,"!=" : operator.ne,
+               ">" : operator.gt,">=" : operator.ge}
+
+class FactsException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def version_key(version):
+    """turn an IOS version string such as 12.2(55)SE into a comparable tuple"""
+    return tuple([int(n) for n in version_num_re.findall(version or "")])
+
+def parse_uptime(uptime):
+    """turn an uptime string such as "1 week, 2 days, 3 hours" into seconds"""
+    return sum([int(n) * uptime_seconds[unit] for n,unit in uptime_part_re.findall(uptime or "")])
+
+class Column(object):
+    """Column holds the values of one fact for every device of the store
+
+    Numeric columns are backed by an array.array. Category columns are dictionary
+    encoded: the array holds an integer code per row and the distinct values are
+    kept once, so a predicate on a category column is evaluated once per distinct
+    value and mapped over the codes instead of once per row.
+
+    Attributes:
+        _kind   : one of INT, FLOAT or CATEGORY
+        _data   : an array.array holding the values or the category codes
+        _values : a list of the distinct values of a category column
+        _index  : a dictionary of distinct value to its code
+    """
+
+    def __init__(self,kind):
+        self._kind   = kind
+        self._data   = array.array(INT if kind == CATEGORY else kind)
+        self._values = []
+        self._index  = {}
+
+    @property
+    def kind(self):
+        return self._kind
+
+    @property
+    def data(self):
+        return self._data
+
+    @property
+    def values(self):
+        return self._values
+
+    def append(self,value):
+        if self._kind != CATEGORY:
+            self._data.append(value)
+            return
+        code = self._index.get(value)
+        if code is None:
+            code = len(self._values)
+            self._values.append(value)
+            self._index[value] = code
+        self._data.append(code)
+
+    def get(self,row):
+        if self._kind == CATEGORY:
+            return self._values[self._data[row]]
+        return self._data[row]
+
+    def decoded(self):
+        """return the plain list of the values of every row"""
+        if self._kind == CATEGORY:
+            return map(self._values.__getitem__,self._data)
+        return self._data.tolist()
+
+    def mask(self,predicate):
+        """return a bytearray holding 1 for every row whose value satisfies predicate"""
+        if self._kind == CATEGORY:
+            lut = bytearray([1 if predicate(value) else 0 for value in self._values])
+            return bytearray(map(lut.__getitem__,self._data))
+        return bytearray(map(predicate,self._data))
+
+class FactStore(object):
+    """FactStore is a columnar store of the facts collected from a fleet of devices
+
+    Every row is one device of one collection run. Filters return bytearray masks
+    which can be combined with both() / either() and passed to count(), select() and
+    group_by(). The store is persisted as a json header followed by the raw bytes
+    of every column array.
+
+    Attributes:
+        _columns : a dictionary of column name to Column object
+        _order   : a list of the column names in schema order
+        _rows    : an integer holding the number of rows
+    """
+
+    def __init__(self,schema=SCHEMA):
+        self._order   = [name for name,kind in schema]
+        self._columns = dict([(name,Column(kind)) for name,kind in schema])
+        self._rows    = 0
+
+    def __len__(self):
+        return self._rows
+
+    def column(self,name):
+        if name not in self._columns:
+            raise FactsException("No column %s in the fact store" % name)
+        return self._columns[name]
+
+    def append(self,row):
+        """append the facts of one device, a dictionary of column name to value"""
+        for name in self._order:
+            column = self._columns[name]
+            value  = row.get(name)
+            if value is None:
+                value = "" if column.kind == CATEGORY else 0
+            column.append(value)
+        self._rows = self._rows + 1
+
+    def row(self,index):
+        return dict([(name,self._columns[name].get(index)) for name in self._order])
+
+    def where(self,name,predicate):
+        """return the mask of the rows whose column satisfies a predicate"""
+        return self.column(name).mask(predicate)
+
+    def compare(self,name,op,value):
+        """return the mask of the rows whose column compares to value, e.g. ("pod","<",10)
+
+           Version columns are compared on version_key() so that "12.2(55)SE" < "15.0".
+        """
+        func = comparators[op]
+        if name == "version":
+            key = version_key(value)
+            return self.where(name,lambda v: func(version_key(v),key))
+        return self.where(name,lambda v: func(v,value))
+
+    def both(self,*masks):
+        return bytearray(map(min,*masks)) if len(masks) > 1 else masks[0]
+
+    def either(self,*masks):
+        return bytearray(map(max,*masks)) if len(masks) > 1 else masks[0]
+
+    def count(self,mask=None):
+        return self._rows if mask is None else mask.count("\x01")
+
+    def select(self,name,mask=None):
+        """return the values of a column for the rows of a mask"""
+        values = self.column(name).decoded()
+        if mask is None:
+            return values
+        return list(itertools.compress(values,mask))
+
+    def group_by(self,name,mask=None,total=None):
+        """count the rows (or sum the total column) per value of a column
+
+           Returns:
+               A dictionary of column value to row count or to the sum of total
+        """
+        column = self.column(name)
+        keys   = column.data if mask is None else itertools.compress(column.data,mask)
+        if total is None:
+            counts = Counter(keys)
+        else:
+            totals = self.column(total).data
+            totals = totals if mask is None else itertools.compress(totals,mask)
+            counts = Counter()
+            for key,value in itertools.izip(keys,totals):
+                counts[key] += value
+        if column.kind == CATEGORY:
+            return dict([(column.values[code],n) for code,n in counts.items()])
+        return dict(counts)
+
+    def save(self,path):
+        """persist the store to path"""
+        if os.path.dirname(path) != "" and os.path.isdir(os.path.dirname(path)) == False:
+            os.makedirs(os.path.dirname(path))
+        header = {"rows"   : self._rows,
+                  "schema" : [(name,self._columns[name].kind) for name in self._order],
+                  "values" : dict([(name,self._columns[name].values) for name in self._order \
+                                   if self._columns[name].kind == CATEGORY])}
+        with open(path,"wb") as f:
+            f.write(json.dumps(header) + "\n")
+            for name in self._order:
+                self._columns[name].data.tofile(f)
+
+def load(path):
+    """read back a store persisted with FactStore.save()"""
+    with open(path,"rb") as f:
+        header = json.loads(f.readline())
+        store  = FactStore([(str(name),str(kind)) for name,kind in header["schema"]])
+        for name in store._order:
+            column = store._columns[name]
+            column.data.fromfile(f,header["rows"])
+            if column.kind == CATEGORY:
+                column._values = header["values"][name]
+                column._index  = dict([(value,code) for code,value in enumerate(column._values)])
+        store._rows = header["rows"]
+    return store
+
+def diff(old,new,columns=None):
+    """compare two collection runs device by device
+
+       The devices of both runs are aligned once, then every column is gathered and
+       compared as a whole into a mask, a category column on its codes once the old
+       codes are translated into the codes of the new run. Only the rows of the
+       changed devices are decoded.
+
+       Returns:
+           A dictionary of device name to a dictionary of column name to (old,new)
+           values. Devices missing from one of the runs have None on that side.
+    """
+    columns = columns or [name for name in new._order if name not in ["device","collected"]]
+    old_rows = dict(itertools.izip(old.column("device").decoded(),itertools.count()))
+    new_rows = dict(itertools.izip(new.column("device").decoded(),itertools.count()))
+    common   = [dev_name for dev_name in new.column("device").decoded() if dev_name in old_rows]
+    old_idx  = map(old_rows.__getitem__,common)
+    new_idx  = map(new_rows.__getitem__,common)
+    # runs over the same inventory are usually already aligned
+    old_same = old_idx == range(len(old))
+    new_same = new_idx == range(len(new))
+
+    masks   = {}
+    changed = set()
+    for name in columns:
+        a,b = old.column(name),new.column(name)
+        if old_same and new_same and a.data == b.data \
+                and (a.kind != CATEGORY or b.values[:len(a.values)] == a.values):
+            # the whole column is unchanged
+            continue
+        old_data = a.data if old_same else map(a.data.__getitem__,old_idx)
+        new_data = b.data if new_same else map(b.data.__getitem__,new_idx)
+        if a.kind == CATEGORY:
+            # an old value the new run never saw gets -1, which no new code equals
+            lut = [b._index.get(value,-1) for value in a.values]
+            old_data = map(lut.__getitem__,old_data)
+        masks[name] = bytearray(map(operator.ne,old_data,new_data))
+        changed.update(itertools.compress(xrange(len(common)),masks[name]))
+
+    changes = {}
+    for k in changed:
+        changes[common[k]] = dict([(name,(old.column(name).get(old_idx[k]),
+                                          new.column(name).get(new_idx[k]))) \
+                                   for name in columns if name in masks and masks[name][k]])
+    for dev_name in set(old_rows) - set(new_rows):
+        changes[dev_name] = dict([(name,(old.column(name).get(old_rows[dev_name]),None)) \
+                                  for name in columns])
+    for dev_name in set(new_rows) - set(old_rows):
+        changes[dev_name] = dict([(name,(None,new.column(name).get(new_rows[dev_name]))) \
+                                  for name in columns])
+    return changes
+
+def collect(dev):
+    """collect the facts of a logged in, enabled device with the parsers of parsers.py
+
+       Returns:
+           A dictionary of column name to value, ready for FactStore.append()
+    """
+    version    = dev.parse_cmd("show version")
+    version    = version[0] if version else parsers.Version(*([None] * 7))
+    interfaces = dev.parse_cmd("show ip interface brief")
+    row = {"device"   : dev.name,
+           "pod"      : int(pod_re.findall(dev.name)[0]) if pod_re.findall(dev.name) else 0,
+           "model"    : version.model or "",
+           "version"  : version.version or "",
+           "uptime"   : parse_uptime(version.uptime),
+           "interfaces_up"   : len([i for i in interfaces if i.protocol == "up"]),
+           "interfaces_down" : len([i for i in interfaces if i.status == "up" \
+                                    and i.protocol == "down"]),
+           "interfaces_admin_down" : len([i for i in interfaces \
+                                          if i.status == "administratively down"]),
+           "down_interfaces" : ",".join([i.interface for i in interfaces \
+                                         if i.status == "up" and i.protocol == "down"]),
+           "vlans"    : "",
+           "collected": time.time()}
+    if dev.is_switch():
+        row["vlans"] = ",".join([str(vlan.vlan_id) for vlan in dev.parse_cmd("show vlan brief")])
+    return row
+
+def save_row(row,execution_name,facts_dir=FACTS_DIR):
+    """write the facts of one device to facts/$execution_name/$devicename.json
+
+       Every device of an execution writes its own file, so the worker threads need no
+       lock and a resumed execution keeps the facts of the devices it skips.
+    """
+    path = os.path.join(facts_dir,execution_name)
+    if os.path.isdir(path) == False:
+        try:
+            os.makedirs(path)
+        except OSError:
+            # created meanwhile by another device
+            pass
+    with open(os.path.join(path,row["device"] + ".json"),"w") as f:
+        json.dump(row,f)
+
+def gather(execution_name,facts_dir=FACTS_DIR):
+    """build the store of an execution out of its device files and persist it to
+       facts/$execution_name.facts
+
+       Returns:
+           The FactStore object
+    """
+    store = FactStore()
+    for path in sorted(glob.glob(os.path.join(facts_dir,execution_name,"*.json"))):
+        with open(path) as f:
+            store.append(json.load(f))
+    store.save(os.path.join(facts_dir,execution_name + ".facts"))
+    return store
+
+def benchmark(rows=10000):
+    """time typical queries over a synthetic fleet, returns seconds per query"""
+    models   = ["WS-C2960-24TT-L","WS-C3560-24PS","CISCO2811","CISCO1841","ISR4321"]
+    versions = ["12.2(55)SE","12.4(24)T","15.0(2)SE4","15.1(4)M","16.3.5"]
+    store = FactStore()
+    for i in range(rows):
+        store.append({"device" : "%dR%d" % (i / 4,i % 4),"pod" : i / 4,
+                      "model" : models[i % 5],"version" : versions[i * 7 % 5],
+                      "uptime" : i * 60,"interfaces_up" : i % 3,"interfaces_down" : i % 2,
+                      "down_interfaces" : "GigabitEthernet0/1" if i % 11 == 0 else ""})
+    timings = {}
+    start = time.time()
+    store.count(store.both(store.where("model",lambda m: "2960" in m),
+                           store.compare("version","<","15.0")))
+    timings["old 2960s"] = time.time() - start
+    start = time.time()
+    set(store.select("pod",store.where("down_interfaces",lambda d: "GigabitEthernet0/1" in d)))
+    timings["pods with uplinks down"] = time.time() - start
+    start = time.time()
+    store.group_by("model",total="interfaces_down")
+    timings["down interfaces per model"] = time.time() - start
+    later = FactStore()
+    for i in range(rows):
+        later.append({"device" : "%dR%d" % (i / 4,i % 4),"pod" : i / 4,
+                      "model" : models[i % 5],"version" : versions[(i * 7 + (i % 50 == 0)) % 5],
+                      "uptime" : i * 60,"interfaces_up" : i % 3,"interfaces_down" : i % 2,
+                      "down_interfaces" : "GigabitEthernet0/1" if i % 13 == 0 else ""})
+    start = time.time()
+    diff(store,later)
+    timings["diff of two runs"] = time.time() - start
+    return timings
+
+if __name__ == "__main__":
+    for query,seconds in sorted(benchmark().items()):
+        print "%-28s: %.2f ms" % (query,seconds * 1000)
@@ -0,0 +1,394 @@
+#!/usr/bin/python
+"""inwk - run an operation over a selection of lab devices
+
+Usage examples:
+    inwk.py list pods 1-9 routers 1-4 switches 1
+    inwk.py scan pods 12-20
+    inwk.py reset pods 1-9 routers 1-4 switches 1 --mode replace
+    inwk.py save 5R3 6S1
+    inwk.py push pods 3 routers 1,2 --dry-run
+    inwk.py facts pods 1-9
+    inwk.py reset pods 1-9 routers 1-4 switches 1 --dry-run --threads 16
+
+A selector is a list of clauses: "pods", "routers" and "switches" each followed
+by numbers and ranges such as 1-4,7, or explicit device names such as 5R3. Pods
+default to every pod; with neither routers nor switches every device of the pods
+is selected.
+
+Only argparse is imported at startup. The device, journal, dashboard and
+preflight modules are imported by the subcommands which need them and the
+devices are built by the workers as the selection is streamed to them, so help
+and dry runs start as fast as the interpreter.
+"""
+
+import re
+import sys
+import argparse
+
+# Pods of the lab, pod 11 is in construction
+ALL_PODS     = range(1,11) + range(12,21)
+ALL_ROUTERS  = [1,2,3,4]
+ALL_SWITCHES = [1,2,3]
+
+# Selector keywords and the selection key they fill
+KEYWORDS = {"pod"      : "pods",
+            "pods"     : "pods",
+            "router"   : "routers",
+            "routers"  : "routers",
+            "switch"   : "switches",
+            "switches" : "switches"}
+
+# Number of devices scanned together by the preflight of a streamed selection
+PREFLIGHT_CHUNK = 64
+
+# Stage of every operation, run between enable and disconnect
+OPERATION_STAGES = {"reset" : "reset",
+                    "save"  : "save_config",
+                    "push"  : "push_config",
+                    "facts" : "collect_facts"}
+
+# Compiled regular expressions to parse the selectors
+range_re = re.compile("^(\d+)(-(\d+))?$")
+name_re  = re.compile("^(\d+)([RS])(\d)$")
+
+class SelectorError(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def parse_numbers(s):
+    """turn a string such as 1-4,7 into the list [1,2,3,4,7]
+
+       Raises:
+           SelectorError : the string is not a list of numbers and ranges
+    """
+    numbers = []
+    for item in s.split(","):
+        m = range_re.match(item)
+        if m is None:
+            raise SelectorError("%s is not a number or a range" % item)
+        low  = int(m.group(1))
+        high = int(m.group(3)) if m.group(3) is not None else low
+        if high < low:
+            raise SelectorError("Range %s is reversed" % item)
+        numbers.extend([n for n in range(low,high + 1) if n not in numbers])
+    return numbers
+
+def parse_selector(tokens):
+    """parse the tokens of a selector expression
+
+       Args:
+           tokens : a list of strings, e.g. ["pods","1-9","routers","1-4"]
+
+       Returns:
+           A dictionary with the keys pods, routers, switches (lists of numbers or
+           None when not given) and names (a list of device names)
+
+       Raises:
+           SelectorError : the expression is not valid
+    """
+    selection = {"pods" : None,"routers" : None,"switches" : None,"names" : []}
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if name_re.match(token) is not None:
+            selection["names"].append(token)
+            i = i + 1
+            continue
+        key = KEYWORDS.get(token.lower())
+        if key is None:
+            raise SelectorError("Unknown selector %s" % token)
+        if i + 1 == len(tokens):
+            raise SelectorError("%s needs numbers, e.g. %s 1-4" % (token,token))
+        numbers = parse_numbers(tokens[i + 1])
+        valid   = {"pods" : ALL_PODS,"routers" : ALL_ROUTERS,"switches" : ALL_SWITCHES}[key]
+        invalid = [str(n) for n in numbers if n not in valid]
+        if invalid != []:
+            raise SelectorError("No such %s %s" % (key[:-1] if key != "switches" \
+                                                   else "switch",",".join(invalid)))
+        selection[key] = (selection[key] or []) + numbers
+        i = i + 2
+    return selection
+
+def select(selection):
+    """stream the device data of a selection, pod by pod
+
+       Returns:
+           A generator of ['device_name',('term_srv','port')] as returned by
+           data.data_fetcher
+    """
+    import data.data_fetcher
+
+    routers  = selection["routers"]
+    switches = selection["switches"]
+    if routers is None and switches is None:
+        routers,switches = ALL_ROUTERS,ALL_SWITCHES
+    if selection["pods"] is not None:
+        pods = selection["pods"]
+    elif selection["names"] != [] and selection["routers"] is None \
+                                  and selection["switches"] is None:
+        # only device names were given
+        pods = []
+    else:
+        pods = ALL_PODS
+
+    seen = set()
+    for pod in pods:
+        # the fetchers rewrite the number lists they are given, hence the copies
+        for device_data in data.data_fetcher.get_pod_routers([pod],list(routers or [])) + \
+                           data.data_fetcher.get_pod_switches([pod],list(switches or [])):
+            seen.add(device_data[0])
+            yield device_data
+    for name in selection["names"]:
+        if name in seen:
+            continue
+        pod,device_type,number = name_re.match(name).groups()
+        if device_type == "R":
+            device_data = data.data_fetcher.get_pod_routers([int(pod)],[int(number)])
+        else:
+            device_data = data.data_fetcher.get_pod_switches([int(pod)],[int(number)])
+        seen.add(name)
+        yield device_data[0]
+
+def _live(stream,run_journal,board):
+    # scan the console lines a chunk at a time so the stream stays lazy
+    import preflight
+    import journal
+
+    def scan(chunk):
+        alive,dead = preflight.live(chunk)
+        for name,state in sorted(dead.items()):
+            run_journal.record(name,"preflight",journal.FAILED,state)
+            board.post(name,"preflight",journal.FAILED)
+            board.message(name,"Skipped, its console line is %s" % state)
+        return alive
+
+    chunk = []
+    for device_data in stream:
+        chunk.append(device_data)
+        if len(chunk) == PREFLIGHT_CHUNK:
+            for alive in scan(chunk):
+                yield alive
+            chunk = []
+    if chunk != []:
+        for alive in scan(chunk):
+            yield alive
+
+def stage_names(command):
+    """return the stage names of an operation, in the order they run
+
+       A reset is followed by the boot of the device, watched by the watcher of the
+       run before the console session is disconnected.
+    """
+    operation = [OPERATION_STAGES[command]]
+    if command == "reset":
+        operation.append("watch_reload")
+    return ["pre_process","login","enable"] + operation + ["disconnect","post_process"]
+
+def stages(dev,args):
+    """return the (stage_name,callable) list of the operation of a device"""
+    import facts
+
+    calls = {"pre_process"  : dev.pre_process,
+             "login"        : lambda: dev.login(args.username,args.password),
+             "enable"       : dev.enable,
+             "reset"        : lambda: dev.reset(args.erase_vlan,args.mode),
+             "watch_reload" : None,
+             "save_config"  : dev.save_config,
+             "push_config"  : dev.push_config,
+             "collect_facts": lambda: facts.save_row(facts.collect(dev),dev.execution_name),
+             "disconnect"   : dev.disconnect,
+             "post_process" : dev.post_process}
+    return [(name,calls[name]) for name in stage_names(args.command)]
+
+def execute(stream,args):
+    """run the operation of the arguments over a stream of device data
+
+       The devices are built by the worker threads as they pull the stream, which
+       is consumed no faster than the workers, through a bounded queue. A worker
+       holds one of the sessions of the terminal server of its device, see
+       termsrv_limits in data.raw_data, while the device runs. A reloaded device is
+       handed over to a single watcher thread after its reset, which follows the
+       boot, disconnects, journals and releases the device, so neither the worker
+       nor the session are held for the boot.
+
+       Returns:
+           A tuple (elapsed seconds,execution name,dictionary of device name to its
+           journal record)
+    """
+    import time
+    import datetime
+    import threading
+    import Queue
+    import device
+    import journal
+    import dashboard
+    import watcher
+    import data.data_fetcher
+
+    if args.resume == "":
+        execution_name = datetime.datetime.now().strftime("%Y-%m-%d-%H")
+        finished = set()
+    else:
+        execution_name = args.resume
+        finished = journal.completed(execution_name)
+
+    run_journal = journal.Journal(execution_name)
+    board = dashboard.Dashboard([])
+    stream = (device_data for device_data in stream if device_data[0] not in finished)
+    if args.no_preflight == False:
+        stream = _live(stream,run_journal,board)
+
+    queue = Queue.Queue(maxsize=args.threads * 2)
+    sessions = dict([(termsrv,threading.BoundedSemaphore(limit)) for termsrv,limit \
+                     in data.data_fetcher.get_termsrv_limits().items()])
+    reload_watcher = watcher.ReloadWatcher(getattr(args,"boot_timeout",watcher.BOOT_TIMEOUT),
+                                           args.username,args.password)
+
+    def worker():
+        while True:
+            device_data = queue.get()
+            dev = None
+            handed = False
+            try:
+                if device_data is None:
+                    return
+                dev = device.Device(device_data,execution_name,dashboard=board)
+                session = sessions.get(dev.termsrv)
+                if session is not None:
+                    session.acquire()
+                try:
+                    handed = watcher.run_stages(reload_watcher,run_journal,dev,
+                                                stages(dev,args),board)
+                finally:
+                    if session is not None:
+                        session.release()
+            except Exception:
+                pass
+            finally:
+                if dev is not None and not handed:
+                    # a failed stage skipped post_process, a handed over device is
+                    # released by the watcher
+                    dev.release()
+                queue.task_done()
+
+    start = time.time()
+    board.start()
+    reload_watcher.start()
+    threads = [threading.Thread(target=worker) for i in range(args.threads)]
+    for t in threads:
+        t.setDaemon(True)
+        t.start()
+    for device_data in stream:
+        board.post(device_data[0],"queued",dashboard.PENDING)
+        queue.put(device_data)
+    for t in threads:
+        queue.put(None)
+    queue.join()
+    reload_watcher.stop()
+    board.stop()
+    run_journal.close()
+    return time.time() - start,execution_name,journal.load(execution_name)
+
+def cmd_list(args,stream):
+    n = 0
+    for device_data in stream:
+        print "%-6s %s %s" % (device_data[0],device_data[1][0],device_data[1][1])
+        n = n + 1
+    print "%s devices selected" % n
+
+def cmd_scan(args,stream):
+    import preflight
+    states = preflight.scan(list(stream))
+    for name in sorted(states):
+        print "%-6s %s" % (name,states[name])
+
+def cmd_operation(args,stream):
+    if args.dry_run:
+        import planner
+        import data.data_fetcher
+        estimator = planner.Estimator(planner.history())
+        print planner.report(args.command,list(stream),stage_names(args.command),
+                             args.threads,data.data_fetcher.get_termsrv_limits(),estimator,
+                             planner.ASSUMED_TERMSRV_LIMIT)
+        return
+    elapsed,execution_name,records = execute(stream,args)
+    if args.command == "facts":
+        import facts
+        store = facts.gather(execution_name)
+        print "Collected the facts of %s devices into %s" \
+              % (len(store),"%s/%s.facts" % (facts.FACTS_DIR,execution_name))
+    print "Elapsed Time : %s" % elapsed
+
+def cmd_startup(args,stream):
+    """measure the cold start of the help and of a dry-run of the whole inventory"""
+    import os
+    import time
+    import subprocess
+
+    script = os.path.abspath(__file__).replace(".pyc",".py")
+    runs   = {"--help"            : [script,"--help"],
+              "list (inventory)"  : [script,"list"]}
+    with open(os.devnull,"w") as devnull:
+        for label,argv in sorted(runs.items()):
+            samples = []
+            for i in range(args.repeat):
+                start = time.time()
+                subprocess.call([sys.executable] + argv,stdout=devnull,stderr=devnull)
+                samples.append(time.time() - start)
+            samples.sort()
+            print "%-18s : median %.3fs  best %.3fs" % (label,samples[len(samples) / 2],
+                                                       samples[0])
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="inwk",description="Run an operation over a "
+                                     "selection of lab devices, e.g. "
+                                     "inwk reset pods 1-9 routers 1-4 switches 1")
+    subparsers = parser.add_subparsers(dest="command")
+
+    def add(name,func,help):
+        sub = subparsers.add_parser(name,help=help)
+        sub.add_argument("selector",nargs="*",
+                         help="e.g. pods 1-9 routers 1-4 switches 1, or device names")
+        sub.set_defaults(func=func)
+        return sub
+
+    add("list",cmd_list,"print the selected devices")
+    add("scan",cmd_scan,"probe the console lines of the selected devices")
+    operations = [add("reset",cmd_operation,"reset the selected devices"),
+                  add("save",cmd_operation,"archive the running-config of the selected devices"),
+                  add("push",cmd_operation,"push config/$devicename.cfg to the selected devices"),
+                  add("facts",cmd_operation,"collect the facts of the selected devices into "
+                                            "facts/$execution_name.facts")]
+    operations[0].add_argument("--mode",choices=["reload","replace"],default="reload")
+    operations[0].add_argument("--erase-vlan",action="store_true")
+    operations[0].add_argument("--boot-timeout",type=int,default=900,
+                               help="seconds a reloaded device is given to come back")
+    for sub in operations:
+        sub.add_argument("--username",default="username")
+        sub.add_argument("--password",default="password")
+        sub.add_argument("--threads",type=int,default=10)
+        sub.add_argument("--resume",metavar="EXECUTION_NAME",default="",
+                         help="skip the devices which completed in the given execution")
+        sub.add_argument("--no-preflight",action="store_true",
+                         help="do not skip the devices whose console line is not reachable")
+        sub.add_argument("--dry-run",action="store_true",
+                         help="print the predicted schedule and the recommended "
+                              "threads without touching any device")
+    startup = subparsers.add_parser("startup",help="measure the cold start time")
+    startup.add_argument("--repeat",type=int,default=5)
+    startup.set_defaults(func=cmd_startup,selector=[])
+    return parser
+
+def main(argv=None):
+    parser = build_parser()
+    args   = parser.parse_args(argv)
+    try:
+        stream = select(parse_selector(args.selector))
+        args.func(args,stream)
+    except SelectorError as e:
+        parser.error(e.error_string)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+
+import os
+import json
+import time
+import threading
+
+# Status values recorded in the journal
+STARTED   = "started"
+DONE      = "done"
+FAILED    = "failed"
+COMPLETE  = "complete"
+
+class JournalException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+class Journal(object):
+    """Journal is a durable, append-only record of the per-device progress of a run
+
+    Every stage transition of every device is appended as one json line to
+    logs/<execution_name>/journal and flushed to disk before the stage continues,
+    so that a run which died halfway can be resumed by skipping the devices whose
+    last record is COMPLETE. The journal is shared by all worker threads.
+
+    Attributes:
+        _execution_name : a string holding the name of the journaled execution
+        _path           : a string holding the path of the journal file
+        _fd             : the file object the records are appended to
+        _lock           : a threading.Lock serializing the writers
+    """
+
+    def __init__(self,execution_name):
+        self._execution_name = execution_name
+        self._path = "logs/" + execution_name + "/journal"
+        if os.path.isdir("logs/" + execution_name) == False:
+            os.makedirs("logs/" + execution_name)
+        self._fd   = open(self._path,"a")
+        self._lock = threading.Lock()
+
+    @property
+    def execution_name(self):
+        return self._execution_name
+
+    @property
+    def path(self):
+        return self._path
+
+    def record(self,name,stage,status,error=""):
+        """append a stage transition of a device to the journal
+
+           Args:
+               name   : a string holding the device name
+               stage  : a string holding the stage name, e.g. login or reset
+               status : one of STARTED, DONE, FAILED or COMPLETE
+               error  : a string holding the exception type when status is FAILED
+        """
+        line = json.dumps({"time"   : time.time(),
+                           "device" : name,
+                           "stage"  : stage,
+                           "status" : status,
+                           "error"  : error})
+        with self._lock:
+            self._fd.write(line + "\n")
+            self._fd.flush()
+            os.fsync(self._fd.fileno())
+
+    def close(self):
+        with self._lock:
+            self._fd.close()
+
+def load(execution_name):
+    """read back the last journaled record of every device of an execution
+
+       The journal of a compressed execution is read out of its archive. When the
+       execution was resumed since, the records of the new directory follow the
+       archived ones.
+
+       Args:
+           execution_name : a string holding the name of the execution to load
+
+       Returns:
+           A dictionary of device name to its last record
+
+       Raises:
+           JournalException : when no journal exists for the execution
+    """
+    import retention
+
+    lines = []
+    try:
+        lines = retention.read_archived(execution_name,"journal").splitlines(True)
+    except retention.RetentionException:
+        pass
+    path = "logs/" + execution_name + "/journal"
+    if os.path.isfile(path):
+        with open(path) as f:
+            lines = lines + f.readlines()
+    elif lines == []:
+        raise JournalException("No journal found for execution %s" % execution_name)
+
+    last = {}
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:
+            # a torn last line is left behind when the host died mid-write
+            continue
+        last[entry["device"]] = entry
+    return last
+
+def completed(execution_name):
+    """return the set of device names which completed in a journaled execution"""
+    return set([name for name,entry in load(execution_name).items() \
+                if entry["status"] == COMPLETE])
+
+def run_stages(journal,device,stages,dashboard=None,complete=True):
+    """run the stages of a device while journaling each transition
+
+       Args:
+           journal   : a Journal object
+           device    : a device object
+           stages    : a list of (stage_name,callable) tuples run in order
+           dashboard : a dashboard.Dashboard object the transitions are also posted to
+           complete  : a boolean, False when more stages of the device run later on and
+                       the device is not to be recorded COMPLETE yet
+
+       Raises:
+           any exception raised by a stage, after it has been journaled as FAILED
+    """
+    def record(stage,status,error=""):
+        journal.record(device.name,stage,status,error)
+        if dashboard is not None:
+            dashboard.post(device.name,stage,status)
+
+    for stage,func in stages:
+        record(stage,STARTED)
+        try:
+            func()
+        except BaseException as e:
+            record(stage,FAILED,type(e).__name__)
+            raise
+        record(stage,DONE)
+    if complete:
+        record("all",COMPLETE)
@@ -0,0 +1,311 @@
+#!/usr/bin/python
+
+import re
+import sys
+import time
+from collections import namedtuple
+
+# Records returned by the parsers
+Version    = namedtuple("Version",["hostname","version","image","model","serial","uptime",
+                                   "config_register"])
+IPInterface = namedtuple("IPInterface",["interface","address","ok","method","status",
+                                        "protocol"])
+Vlan       = namedtuple("Vlan",["vlan_id","name","status","ports"])
+PortStatus = namedtuple("PortStatus",["port","name","status","vlan","duplex","speed","type"])
+Inventory  = namedtuple("Inventory",["name","descr","pid","vid","serial"])
+
+# Rule kinds of a template
+RECORD   = "record"    # the line is a whole record
+FILL     = "fill"      # the line fills some fields of the single record of the output
+START    = "start"     # the line starts a record which later lines may complete
+EXTEND   = "extend"    # the line appends to the list field of the started record
+COMPLETE = "complete"  # the line fills the remaining fields of the started record and emits it
+
+# Compiled regular expression to turn the named groups of the rules into plain groups
+group_name_re = re.compile("\(\?P<\w+>")
+
+class ParserException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def _ports(s):
+    return [port.strip() for port in s.split(",") if port.strip() != ""]
+
+class Template(object):
+    """Template describes how the lines of a show command output map to records
+
+    Every rule of a template is a (regex,kind,converters) tuple. The regexes are
+    compiled once when the template is built, their named groups are the record
+    fields and the converters are applied to the captured strings, e.g. int for
+    the vlan id. A line is matched against the rules in order and the first one
+    which matches decides what happens to the record, see the rule kinds above.
+
+    Attributes:
+        _command : a string holding the command the template parses
+        _record  : the namedtuple class of the records
+        _rules   : a list of (compiled regex,kind,converters) tuples
+        _extend  : a string holding the list field EXTEND rules append to
+        _block   : a boolean, True when the template is a single RECORD rule without
+                   converters, whose records are then matched over a whole block of
+                   lines at once instead of line by line
+        _order   : a list per rule of the group index of every record field
+        _prefix  : a compiled regex every interesting line matches, used to skip the
+                   other lines without trying each rule (None for a single rule)
+    """
+
+    def __init__(self,command,record,rules,extend_field=None):
+        self._command = command
+        self._record  = record
+        self._rules   = [(re.compile(regex,re.M),kind,converters) \
+                         for regex,kind,converters in rules]
+        self._extend  = extend_field
+        self._block   = len(rules) == 1 and rules[0][1] == RECORD and rules[0][2] == {}
+        self._order   = [[rule[0].groupindex.get(field) for field in record._fields] \
+                         for rule in self._rules]
+        self._prefix  = None
+        if len(self._rules) > 1:
+            self._prefix = re.compile("|".join(["(?:%s)" % group_name_re.sub("(?:",rule[0].pattern) \
+                                                for rule in self._rules]))
+
+    @property
+    def command(self):
+        return self._command
+
+    @property
+    def record(self):
+        return self._record
+
+    def stream(self):
+        """return a StreamParser fed with chunks of the output of the command"""
+        return StreamParser(self)
+
+    def parse(self,output):
+        """parse a whole command output and return the list of records"""
+        parser = self.stream()
+        parser.feed(output)
+        return parser.close()
+
+class StreamParser(object):
+    """StreamParser parses the output of a command chunk by chunk as it arrives
+
+    Chunks are split into lines, the complete lines are parsed right away and the
+    trailing partial line is kept until the next chunk or close().
+
+    Attributes:
+        _template : the Template object driving the parser
+        _partial  : a string holding the trailing partial line of the last chunk
+        _fields   : a dictionary holding the fields of the record being built
+        _records  : a list of the records emitted so far
+    """
+
+    def __init__(self,template):
+        self._template = template
+        self._partial  = ""
+        self._fields   = None
+        self._records  = []
+
+    @property
+    def partial(self):
+        return self._partial
+
+    @property
+    def records(self):
+        return self._records
+
+    def feed(self,chunk):
+        """parse the complete lines of a chunk of output"""
+        data = self._partial + chunk
+        end  = data.rfind("\n")
+        if end < 0:
+            self._partial = data
+            return
+        self._partial = data[end + 1:]
+        self._lines(data[:end])
+
+    def close(self):
+        """parse the trailing partial line and return all the records"""
+        if self._partial != "":
+            self._lines(self._partial)
+            self._partial = ""
+        self._emit()
+        return self._records
+
+    def _lines(self,block):
+        template = self._template
+        if template._block:
+            regex = template._rules[0][0]
+            order = template._order[0]
+            make  = template.record._make
+            if order == range(1,len(order) + 1):
+                self._records.extend(map(make,regex.findall(block.replace("\r",""))))
+            else:
+                for m in regex.finditer(block.replace("\r","")):
+                    self._records.append(make([m.group(i) for i in order]))
+            return
+        for line in block.splitlines():
+            self._line(line)
+
+    def _line(self,line):
+        template = self._template
+        if template._prefix is not None and template._prefix.search(line) is None:
+            return
+        for regex,kind,converters in template._rules:
+            m = regex.match(line)
+            if m is None:
+                continue
+            fields = m.groupdict()
+            for field,func in converters.items():
+                if fields.get(field) is not None:
+                    fields[field] = func(fields[field])
+            if kind == RECORD:
+                self._emit()
+                self._records.append(self._build(fields))
+            elif kind == FILL:
+                if self._fields is None:
+                    self._fields = {}
+                for field,value in fields.items():
+                    if self._fields.get(field) is None:
+                        self._fields[field] = value
+            elif kind == START:
+                self._emit()
+                self._fields = fields
+            elif kind == EXTEND:
+                if self._fields is not None:
+                    self._fields[template._extend] = self._fields[template._extend] \
+                                                     + fields[template._extend]
+            elif kind == COMPLETE:
+                if self._fields is not None:
+                    self._fields.update(fields)
+                    self._emit()
+            return
+
+    def _build(self,fields):
+        record = self._template.record
+        return record(**dict([(field,fields.get(field)) for field in record._fields]))
+
+    def _emit(self):
+        if self._fields is not None:
+            self._records.append(self._build(self._fields))
+            self._fields = None
+
+# Templates of the supported show commands
+show_version = Template("show version",Version,[
+    ("^(?P<hostname>\S+)\s+uptime\s+is\s+(?P<uptime>.+)$",FILL,{}),
+    ("^(Cisco\s+)?IOS.*Version\s+(?P<version>[^,\s]+)",FILL,{}),
+    ("^System\s+image\s+file\s+is\s+\"(?P<image>[^\"]+)\"",FILL,{}),
+    # the memory line, "Cisco 2811 (revision 53.51) with 251904K/10240K bytes of memory."
+    # on the ISRs and "cisco WS-C2960-24TT-L (PowerPC405) processor ... with 65536K" on
+    # the Catalysts
+    ("^[Cc]isco[ \t]+(?P<model>\S+)[ \t]+\(.*with[ \t]+\d+K",FILL,{}),
+    ("^Processor\s+board\s+ID\s+(?P<serial>\S+)",FILL,{}),
+    ("^Configuration\s+register\s+is\s+(?P<config_register>\S+)",FILL,{}),
+])
+
+show_ip_interface_brief = Template("show ip interface brief",IPInterface,[
+    ("^(?P<interface>[A-Za-z][\w\-\/\.:]*\d)[ \t]+(?P<address>\S+)[ \t]+(?P<ok>YES|NO)[ \t]+"
+     "(?P<method>\S+)[ \t]+(?P<status>administratively[ \t]+down|up|down|deleted)[ \t]+"
+     "(?P<protocol>up|down)",RECORD,{}),
+])
+
+show_vlan_brief = Template("show vlan brief",Vlan,[
+    ("^(?P<vlan_id>\d+)\s+(?P<name>\S+)\s+(?P<status>active|suspended|act/\S+|sus/\S+)"
+     "\s*(?P<ports>.*)$",START,{"vlan_id":int,"ports":_ports}),
+    ("^\s{20,}(?P<ports>\S.*)$",EXTEND,{"ports":_ports}),
+],extend_field="ports")
+
+show_interfaces_status = Template("show interfaces status",PortStatus,[
+    ("^(?P<port>[A-Za-z][\w\-\/\.]*\d)[ \t]+(?P<name>.*?)[ \t]*(?P<status>connected|"
+     "notconnect|disabled|err-disabled|inactive|monitoring|sfpAbsent|suspended)[ \t]+"
+     "(?P<vlan>\S+)[ \t]+(?P<duplex>\S+)[ \t]+(?P<speed>\S+)[ \t]*(?P<type>.*?)[ \t\r]*$",
+     RECORD,{}),
+])
+
+show_inventory = Template("show inventory",Inventory,[
+    ("^NAME:\s*\"(?P<name>[^\"]*)\"\s*,\s*DESCR:\s*\"(?P<descr>[^\"]*)\"",START,{}),
+    ("^PID:\s*(?P<pid>[^,]*?)\s*,\s*VID:\s*(?P<vid>[^,]*?)\s*,\s*SN:\s*(?P<serial>\S*)",
+     COMPLETE,{}),
+])
+
+templates = [show_version,show_ip_interface_brief,show_vlan_brief,show_interfaces_status,
+             show_inventory]
+
+def get_template(command):
+    """return the template parsing a command, abbreviations such as "sh ip int br" accepted
+
+       Raises:
+           ParserException : when no template parses the command
+    """
+    words = command.split()
+    for template in templates:
+        full = template.command.split()
+        if len(words) == len(full) and \
+           all([full[i].startswith(words[i]) and len(words[i]) >= min(2,len(full[i])) \
+                for i in range(len(full))]):
+            return template
+    raise ParserException("No parser for command %s" % command)
+
+def parse(command,output):
+    """parse the output of a command and return the list of records"""
+    return get_template(command).parse(output)
+
+def naive_parse_ip_interface_brief(output):
+    """reference line-by-line parser the compiled templates are benchmarked against"""
+    records = []
+    for line in output.split("\n"):
+        m = re.match("^(\S+)\s+(\S+)\s+(YES|NO)\s+(\S+)\s+(administratively down|up|down|deleted)"
+                     "\s+(up|down)",line.strip())
+        if m:
+            records.append(IPInterface(*m.groups()))
+    return records
+
+def benchmark(rows=5000,repeat=20,chunk_size=4096):
+    """compare the compiled streaming parser against the naive parser
+
+       Returns:
+           A dictionary of parser name to the seconds spent for one output
+    """
+    header = "Interface              IP-Address      OK? Method Status                Protocol\r\n"
+    line   = "GigabitEthernet0/%-6d 10.%d.%d.1       YES NVRAM  up                    up      \r\n"
+    output = header + "".join([line % (i,i / 256 % 256,i % 256) for i in range(rows)])
+    chunks = [output[i:i + chunk_size] for i in range(0,len(output),chunk_size)]
+
+    start = time.time()
+    for i in range(repeat):
+        naive = naive_parse_ip_interface_brief(output)
+    naive_time = (time.time() - start) / repeat
+
+    start = time.time()
+    for i in range(repeat):
+        parser = show_ip_interface_brief.stream()
+        for chunk in chunks:
+            parser.feed(chunk)
+        compiled = parser.close()
+    compiled_time = (time.time() - start) / repeat
+
+    if naive != compiled:
+        raise ParserException("Compiled and naive parsers disagree")
+    return {"naive" : naive_time,"compiled" : compiled_time}
+
+if __name__ == "__main__":
+    result = benchmark()
+    print "naive    : %.2f ms" % (result["naive"] * 1000)
+    print "compiled : %.2f ms" % (result["compiled"] * 1000)
+
+    # self check: the model of a router and of a switch is found on their memory line
+    versions = {"2811"            : "Cisco IOS Software, C2800 Software (C2800NM-ADVIPSERVICESK9-M), "
+                                    "Version 12.4(24)T, RELEASE SOFTWARE (fc1)\r\n"
+                                    "Cisco 2811 (revision 53.51) with 251904K/10240K bytes of "
+                                    "memory.\r\n"
+                                    "Processor board ID FTX1234A5BC\r\n",
+                "WS-C2960-24TT-L" : "Cisco IOS Software, C2960 Software (C2960-LANBASEK9-M), "
+                                    "Version 12.2(55)SE, RELEASE SOFTWARE (fc2)\r\n"
+                                    "cisco WS-C2960-24TT-L (PowerPC405) processor (revision B0) "
+                                    "with 65536K bytes of memory.\r\n"
+                                    "Processor board ID FOC1234X5YZ\r\n"}
+    models = dict([(model,parse("show version",output)[0].model) \
+                   for model,output in versions.items()])
+    for model,parsed in sorted(models.items()):
+        print "model    : %s parsed as %s" % (model,parsed)
+    sys.exit(0 if all([model == parsed for model,parsed in models.items()]) else 1)
@@ -0,0 +1,258 @@
+#!/usr/bin/python
+
+import heapq
+import json
+import retention
+import journal
+
+# Durations in seconds assumed for a stage no run has recorded yet
+DEFAULT_DURATIONS = {"pre_process"  : 0.1,
+                     "login"        : 20,
+                     "enable"       : 5,
+                     "reset"        : 30,
+                     "watch_reload" : 300,
+                     "save_config"  : 30,
+                     "push_config"  : 60,
+                     "collect_facts": 10,
+                     "disconnect"   : 1,
+                     "post_process" : 0.1}
+
+# Number of past executions the durations are learned from
+HISTORY = 10
+
+# Thread counts tried by the recommendation, besides the number of devices
+CANDIDATES = [1,2,4,8,10,12,16,24,32,48,64,96,128]
+
+# A thread count whose wall time is within this ratio of the best one is good enough
+TOLERANCE = 0.05
+
+# Sessions assumed by the dry run for a termsrv missing from termsrv_limits. The
+# executor does not limit such a termsrv, but a sweep simulated without any limit
+# always recommends one thread per device
+ASSUMED_TERMSRV_LIMIT = 8
+
+def _role(name):
+    return "switch" if name.find("S") != -1 else "router"
+
+def _median(samples):
+    ordered = sorted(samples)
+    return ordered[len(ordered) / 2]
+
+def history(executions=HISTORY,log_dir=retention.LOG_DIR):
+    """collect the stage durations of the last journaled executions
+
+       The journals of the compressed executions are read out of their archives.
+
+       Returns:
+           A dictionary of (device name,stage) to the list of its durations in seconds
+    """
+    names = sorted(set(retention.executions(log_dir) + retention.archives(log_dir)),
+                   key=lambda name: retention.execution_time(name))[-executions:]
+    durations = {}
+    for execution_name in names:
+        try:
+            lines = retention.read(execution_name,"journal",log_dir).splitlines()
+        except (retention.RetentionException,IOError):
+            continue
+        started = {}
+        for line in lines:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            key = (entry["device"],entry["stage"])
+            if entry["status"] == journal.STARTED:
+                started[key] = entry["time"]
+            elif entry["status"] == journal.DONE and key in started:
+                durations.setdefault(key,[]).append(entry["time"] - started.pop(key))
+    return durations
+
+class Estimator(object):
+    """Estimator predicts how long a stage takes on a device
+
+    The median of the recorded durations of the device is used first, then the
+    median of the devices of the same role (router or switch), then the default
+    duration of the stage.
+
+    Attributes:
+        _device  : a dictionary of (device name,stage) to its median duration
+        _role    : a dictionary of (role,stage) to its median duration
+    """
+
+    def __init__(self,durations):
+        self._device = dict([(key,_median(samples)) for key,samples in durations.items()])
+        by_role = {}
+        for (name,stage),samples in durations.items():
+            by_role.setdefault((_role(name),stage),[]).extend(samples)
+        self._role = dict([(key,_median(samples)) for key,samples in by_role.items()])
+
+    def stage(self,name,stage):
+        """return the (seconds,source) estimate of a stage, source being device,
+           role or default"""
+        if (name,stage) in self._device:
+            return self._device[(name,stage)],"device"
+        if (_role(name),stage) in self._role:
+            return self._role[(_role(name),stage)],"role"
+        return DEFAULT_DURATIONS.get(stage,1.0),"default"
+
+    def device(self,name,stages):
+        """return the estimated seconds of all the stages of a device"""
+        return sum([self.stage(name,stage)[0] for stage in stages])
+
+class Plan(object):
+    """Plan is the simulated schedule of an operation over a device selection
+
+    The simulation follows the executor of inwk: the devices are taken in order by
+    the first free worker thread, which then waits for a free session on the
+    terminal server of the device and holds both until the device is done, or
+    until it is handed over to the reload watcher after its reset.
+
+    Attributes:
+        threads   : an integer holding the number of worker threads simulated
+        wall_time : a float holding the predicted seconds of the whole sweep
+        schedule  : a list of (device name,termsrv,start,end,finish) tuples, the
+                    worker and the session being held from start to end
+        termsrvs  : a dictionary of termsrv to its devices, limit, peak sessions and
+                    busy seconds
+    """
+
+    def __init__(self,threads,wall_time,schedule,termsrvs):
+        self.threads   = threads
+        self.wall_time = wall_time
+        self.schedule  = schedule
+        self.termsrvs  = termsrvs
+
+def simulate(jobs,threads,limits,default=None):
+    """simulate the schedule of a list of jobs
+
+       Args:
+           jobs    : a list of (device name,termsrv,seconds,tail) in the order they are
+                     queued, tail being the seconds the device still runs once its
+                     worker and session are free
+           threads : an integer holding the number of worker threads
+           limits  : a dictionary of termsrv to its number of concurrent sessions
+           default : an integer holding the sessions of a termsrv not in limits, such a
+                     termsrv is not limited when None
+
+       Returns:
+           A Plan object
+    """
+    workers  = [0.0] * threads
+    sessions = {}
+    termsrvs = {}
+    schedule = []
+    for name,termsrv,seconds,tail in jobs:
+        free  = heapq.heappop(workers)
+        start = free
+        limit = limits.get(termsrv,default)
+        if limit is not None:
+            slots = sessions.setdefault(termsrv,[0.0] * limit)
+            start = max(start,heapq.heappop(slots))
+            heapq.heappush(slots,start + seconds)
+        heapq.heappush(workers,start + seconds)
+        schedule.append((name,termsrv,start,start + seconds,start + seconds + tail))
+        load = termsrvs.setdefault(termsrv,{"devices" : 0,"limit" : limit,
+                                            "peak" : 0,"busy" : 0.0})
+        load["devices"] = load["devices"] + 1
+        load["busy"]    = load["busy"] + seconds
+
+    # peak concurrent sessions per termsrv, from the start and end events
+    events = {}
+    for name,termsrv,start,end,finish in schedule:
+        events.setdefault(termsrv,[]).extend([(start,1),(end,-1)])
+    for termsrv,points in events.items():
+        current = 0
+        for t,delta in sorted(points,key=lambda point: (point[0],point[1])):
+            current = current + delta
+            termsrvs[termsrv]["peak"] = max(termsrvs[termsrv]["peak"],current)
+    wall_time = max([finish for name,termsrv,start,end,finish in schedule] + [0.0])
+    return Plan(threads,wall_time,schedule,termsrvs)
+
+def jobs(device_data_list,stages,estimator):
+    """turn a device selection into the (device name,termsrv,seconds,tail) jobs of simulate
+
+       The stages from watch_reload on run on the reload watcher of the run, they
+       make the tail of the job.
+    """
+    split = stages.index("watch_reload") if "watch_reload" in stages else len(stages)
+    return [(device_data[0],device_data[1][0],
+             estimator.device(device_data[0],stages[:split]),
+             estimator.device(device_data[0],stages[split:])) \
+            for device_data in device_data_list]
+
+def recommend(job_list,limits,candidates=CANDIDATES,default=None):
+    """find the smallest thread count whose wall time is close to the best one
+
+       The termsrv limits, default included, are applied as in simulate.
+
+       Returns:
+           A tuple (recommended Plan object,list of the Plan objects of every candidate)
+    """
+    counts = sorted(set([c for c in candidates if c <= len(job_list)] + [max(1,len(job_list))]))
+    plans  = [simulate(job_list,threads,limits,default) for threads in counts]
+    best   = min([plan.wall_time for plan in plans])
+    for plan in plans:
+        if plan.wall_time <= best * (1 + TOLERANCE):
+            return plan,plans
+
+def duration(seconds):
+    """format seconds as e.g. 1h05m or 4m30s"""
+    seconds = int(round(seconds))
+    if seconds >= 3600:
+        return "%dh%02dm" % (seconds / 3600,seconds % 3600 / 60)
+    if seconds >= 60:
+        return "%dm%02ds" % (seconds / 60,seconds % 60)
+    return "%ds" % seconds
+
+def report(operation,device_data_list,stages,threads,limits,estimator,default=None):
+    """return the printable plan of an operation, at the given and the recommended
+       thread counts
+
+       The termsrvs capped by the assumed default limit rather than by their own are
+       marked with a * in the termsrv table.
+    """
+    job_list = jobs(device_data_list,stages,estimator)
+    if job_list == []:
+        return "No device selected"
+    plan = simulate(job_list,threads,limits,default)
+    recommended,plans = recommend(job_list,limits,default=default)
+    sources = {}
+    for device_data in device_data_list:
+        for stage in stages:
+            source = estimator.stage(device_data[0],stage)[1]
+            sources[source] = sources.get(source,0) + 1
+
+    lines = ["Plan for %s on %s devices with %s threads" % (operation,len(job_list),threads),
+             "  predicted wall time : %s" % duration(plan.wall_time),
+             "  stage estimates     : %s" % ", ".join(["%s from %s history" % (n,source) \
+                                                       if source != "default" \
+                                                       else "%s defaulted" % n \
+                                                       for source,n in sorted(sources.items())]),
+             "  termsrv limits      : %s" \
+             % ("%s sessions assumed (*) where termsrv_limits has none, the run does "
+                "not limit those" % default if default is not None \
+                else "none unless set in termsrv_limits"),
+             "  reload watch        : %s" \
+             % ("boots followed by one watcher thread, no worker or session held" \
+                if "watch_reload" in stages else "none"),
+             "",
+             "  %-16s %7s %6s %5s %9s %6s" % ("termsrv","devices","limit","peak","busy","mean")]
+    for termsrv,load in sorted(plan.termsrvs.items()):
+        if load["limit"] is None:
+            limit = "-"
+        elif termsrv in limits:
+            limit = load["limit"]
+        else:
+            limit = "%s*" % load["limit"]
+        # mean concurrent sessions over the sweep
+        lines.append("  %-16s %7s %6s %5s %9s %6.1f" \
+                     % (termsrv,load["devices"],limit,load["peak"],
+                        duration(load["busy"]),
+                        load["busy"] / plan.wall_time if plan.wall_time else 0.0))
+    lines.extend(["","  %7s %10s" % ("threads","wall time")])
+    for candidate in plans:
+        lines.append("  %7s %10s%s" % (candidate.threads,duration(candidate.wall_time),
+                                       "  <- recommended" if candidate is recommended else ""))
+    lines.extend(["","Recommended: --threads %s, predicted wall time %s" \
+                  % (recommended.threads,duration(recommended.wall_time))])
+    return "\n".join(lines)
@@ -0,0 +1,192 @@
+#!/usr/bin/python
+
+import re
+import time
+import errno
+import select
+import socket
+import resource
+import threading
+from collections import deque
+
+# Reachability states of a terminal server line
+REACHABLE   = "reachable"
+REFUSED     = "refused"
+TIMEOUT     = "timeout"
+BUSY        = "busy"
+UNREACHABLE = "unreachable"
+
+# Compiled regular expression matching the banner of a busy terminal server line
+busy_re = re.compile("[Cc]onnection\s+refused|[Ll]ine\s+(is\s+)?busy|[Pp]ort\s+(is\s+)?in\s+use")
+
+# Results are kept for a short while so that back to back runs do not rescan
+CACHE_TTL = 30
+
+# Probes in flight at once, the connects also share the descriptors of the process
+# with the consoles and the logs, so at most half of RLIMIT_NOFILE is used
+MAX_IN_FLIGHT = 1024
+
+_cache      = {}
+_cache_lock = threading.Lock()
+
+class _Probe(object):
+    """_Probe holds the state of the connection to one (termsrv,port)"""
+
+    def __init__(self,target,sock):
+        self.target   = target
+        self.sock     = sock
+        self.state    = None
+        self.banner   = ""
+        self.deadline = 0.0
+
+def _resolve(hosts):
+    addresses = {}
+    for host in hosts:
+        try:
+            addresses[host] = socket.gethostbyname(host)
+        except socket.error:
+            addresses[host] = None
+    return addresses
+
+def max_in_flight():
+    """return the number of probes scan_targets keeps in flight by default"""
+    try:
+        soft = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
+    except (ValueError,resource.error):
+        return MAX_IN_FLIGHT
+    if soft == resource.RLIM_INFINITY:
+        return MAX_IN_FLIGHT
+    return max(1,min(MAX_IN_FLIGHT,soft / 2))
+
+def scan_targets(targets,timeout=2.0,banner_wait=0.5,in_flight=None):
+    """probe many (termsrv,port) targets at once with non-blocking connects
+
+       The targets are connected to from one select.poll loop, up to in_flight of
+       them at the same time, and a new connect is started as soon as a probe ends.
+       The scan takes about one timeout per in_flight targets without running the
+       process out of descriptors. A connected line is watched for banner_wait
+       seconds to catch the banner of a busy line.
+
+       Args:
+           targets     : a list of (termsrv,port) tuples
+           timeout     : a float holding the seconds to wait for the connects
+           banner_wait : a float holding the seconds to wait for a busy banner
+           in_flight   : an integer holding the number of probes at once,
+                         max_in_flight() when None
+
+       Returns:
+           A dictionary of (termsrv,port) to its state
+    """
+    results   = {}
+    now       = time.time()
+    with _cache_lock:
+        for target in targets:
+            cached = _cache.get(target)
+            if cached is not None and cached[0] > now:
+                results[target] = cached[1]
+    targets = [target for target in set(targets) if target not in results]
+
+    poller    = select.poll()
+    probes    = {}
+    addresses = _resolve(set([host for host,port in targets]))
+    in_flight = in_flight or max_in_flight()
+    waiting   = deque(targets)
+
+    def start():
+        # connect to the waiting targets until in_flight probes are running
+        while waiting and len(probes) < in_flight:
+            target = waiting.popleft()
+            if addresses[target[0]] is None:
+                results[target] = UNREACHABLE
+                continue
+            try:
+                sock = socket.socket(socket.AF_INET,socket.SOCK_STREAM)
+            except socket.error as e:
+                if e.errno not in [errno.EMFILE,errno.ENFILE] or probes == {}:
+                    raise
+                # out of descriptors anyway, wait for the running probes
+                waiting.appendleft(target)
+                return
+            sock.setblocking(0)
+            error = sock.connect_ex((addresses[target[0]],int(target[1])))
+            if error not in [0,errno.EINPROGRESS,errno.EWOULDBLOCK]:
+                results[target] = REFUSED if error == errno.ECONNREFUSED else UNREACHABLE
+                sock.close()
+                continue
+            probe = _Probe(target,sock)
+            probe.deadline = time.time() + timeout
+            probes[sock.fileno()] = probe
+            poller.register(sock,select.POLLOUT | select.POLLERR | select.POLLHUP)
+
+    start()
+    while probes:
+        wait = max(0.0,min([probe.deadline for probe in probes.values()]) - time.time())
+        for fd,event in poller.poll(int(wait * 1000) + 1):
+            probe = probes[fd]
+            if probe.state is None:
+                error = probe.sock.getsockopt(socket.SOL_SOCKET,socket.SO_ERROR)
+                if error == 0:
+                    # connected, give the line a moment to tell us it is busy
+                    probe.state    = REACHABLE
+                    probe.deadline = time.time() + banner_wait
+                    poller.modify(probe.sock,select.POLLIN | select.POLLERR | select.POLLHUP)
+                    continue
+                probe.state = REFUSED if error == errno.ECONNREFUSED else UNREACHABLE
+            else:
+                try:
+                    data = probe.sock.recv(1024)
+                except socket.error:
+                    data = ""
+                probe.banner = probe.banner + data
+                if data != "" and busy_re.search(probe.banner) is None:
+                    continue
+                # a line closed right after the connect is held by someone else
+                probe.state = BUSY
+            results[probe.target] = probe.state
+            poller.unregister(probe.sock)
+            probe.sock.close()
+            del probes[fd]
+
+        now = time.time()
+        for fd,probe in probes.items():
+            if probe.deadline > now:
+                continue
+            results[probe.target] = TIMEOUT if probe.state is None else probe.state
+            poller.unregister(probe.sock)
+            probe.sock.close()
+            del probes[fd]
+        start()
+
+    expiry = time.time() + CACHE_TTL
+    with _cache_lock:
+        for target in targets:
+            _cache[target] = (expiry,results[target])
+    return results
+
+def scan(device_data_list,timeout=2.0,banner_wait=0.5):
+    """probe the console lines of a device list as returned by data.data_fetcher
+
+       Args:
+           device_data_list : a list of ['device_name',('term_srv','port')]
+           timeout          : a float holding the seconds to wait for the connects
+           banner_wait      : a float holding the seconds to wait for a busy banner
+
+       Returns:
+           A dictionary of device name to its state
+    """
+    results = scan_targets([tuple(device_data[1]) for device_data in device_data_list],
+                           timeout,banner_wait)
+    return dict([(device_data[0],results[tuple(device_data[1])]) \
+                 for device_data in device_data_list])
+
+def live(device_data_list,timeout=2.0,banner_wait=0.5):
+    """split a device list into the devices whose line is reachable and the others
+
+       Returns:
+           A tuple (live device data list, dictionary of dead device name to its state)
+    """
+    states = scan(device_data_list,timeout,banner_wait)
+    alive  = [device_data for device_data in device_data_list \
+              if states[device_data[0]] == REACHABLE]
+    dead   = dict([(name,state) for name,state in states.items() if state != REACHABLE])
+    return alive,dead
@@ -0,0 +1,347 @@
+#!/usr/bin/python
+
+import os
+import re
+import json
+import time
+import shutil
+import tarfile
+import argparse
+import datetime
+import threading
+import journal
+
+LOG_DIR = "logs"
+
+# An execution directory is finished once nothing was written to it for this long
+FINISHED_AFTER = 3600
+# Default budgets of the compressed executions
+MAX_AGE_DAYS   = 90
+MAX_BYTES      = 2 * 1024 * 1024 * 1024
+
+# Log levels kept in the index
+INDEXED_LEVELS = ["WARNING","ERROR","CRITICAL"]
+
+# Compiled regular expression matching an indexed line of a device .log file
+log_level_re = re.compile(" - [\w\-]+ - (" + "|".join(INDEXED_LEVELS) + ")\s*- ")
+
+_index_lock  = threading.Lock()
+_index_cache = {}
+
+class RetentionException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def _index_path(log_dir):
+    return os.path.join(log_dir,"index")
+
+def _archive_path(log_dir,execution_name):
+    return os.path.join(log_dir,execution_name + ".tar.gz")
+
+def execution_time(execution_name,path=None):
+    """return the epoch time an execution started, from its name or else its mtime"""
+    try:
+        return time.mktime(datetime.datetime.strptime(execution_name,"%Y-%m-%d-%H").timetuple())
+    except ValueError:
+        return os.path.getmtime(path) if path is not None and os.path.exists(path) else 0.0
+
+def executions(log_dir=LOG_DIR):
+    """return the names of the uncompressed execution directories"""
+    if os.path.isdir(log_dir) == False:
+        return []
+    return sorted([name for name in os.listdir(log_dir) \
+                   if os.path.isdir(os.path.join(log_dir,name))])
+
+def archives(log_dir=LOG_DIR):
+    """return the names of the compressed executions"""
+    if os.path.isdir(log_dir) == False:
+        return []
+    return sorted([name[:-len(".tar.gz")] for name in os.listdir(log_dir) \
+                   if name.endswith(".tar.gz")])
+
+def finished(execution_name,log_dir=LOG_DIR,idle=FINISHED_AFTER):
+    """return True when nothing was written to an execution directory for idle seconds"""
+    path   = os.path.join(log_dir,execution_name)
+    newest = max([os.path.getmtime(os.path.join(path,name)) for name in os.listdir(path)] \
+                 + [os.path.getmtime(path)])
+    return time.time() - newest > idle
+
+def scan(execution_name,log_dir=LOG_DIR):
+    """build the index entries of an uncompressed execution directory
+
+       The log levels come from the device .log files and the exception types from
+       the FAILED records of the journal, when the execution was journaled.
+
+       Returns:
+           A list of dictionaries with the keys device, execution, time, level,
+           exception and count
+    """
+    path   = os.path.join(log_dir,execution_name)
+    start  = execution_time(execution_name,path)
+    counts = {}
+    for name in os.listdir(path):
+        if name.endswith(".log") == False:
+            continue
+        with open(os.path.join(path,name)) as f:
+            for level in log_level_re.findall(f.read()):
+                key = (name[:-len(".log")],level,"")
+                counts[key] = counts.get(key,0) + 1
+    journal_path = os.path.join(path,"journal")
+    if os.path.isfile(journal_path):
+        with open(journal_path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if entry.get("status") == journal.FAILED:
+                    key = (entry["device"],"ERROR",entry.get("error",""))
+                    counts[key] = counts.get(key,0) + 1
+    return [{"device"    : device,
+             "execution" : execution_name,
+             "time"      : start,
+             "level"     : level,
+             "exception" : exception,
+             "count"     : count} for (device,level,exception),count in sorted(counts.items())]
+
+def _append_index(entries,log_dir):
+    with _index_lock:
+        with open(_index_path(log_dir),"a") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+def _rewrite_index(entries,log_dir):
+    with _index_lock:
+        tmp_path = _index_path(log_dir) + ".tmp"
+        with open(tmp_path,"w") as f:
+            for entry in entries:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp_path,_index_path(log_dir))
+
+def load_index(log_dir=LOG_DIR):
+    """read the index, cached until the index file changes
+
+       An execution indexed twice, by a compression interrupted before the directory
+       was removed, keeps a single copy of its entries.
+
+       Returns:
+           A list of index entries ordered by time
+    """
+    path = _index_path(log_dir)
+    if os.path.isfile(path) == False:
+        return []
+    stat = os.stat(path)
+    with _index_lock:
+        cached = _index_cache.get(path)
+        if cached is not None and cached[0] == (stat.st_mtime,stat.st_size):
+            return cached[1]
+        entries = {}
+        with open(path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                entries[(entry["device"],entry["execution"],entry["level"],
+                         entry["exception"])] = entry
+        entries = sorted(entries.values(),key=lambda entry: (entry["time"],entry["device"]))
+        _index_cache[path] = ((stat.st_mtime,stat.st_size),entries)
+        return entries
+
+def _member_name(execution_name,member):
+    # the path of an archive member relative to the execution directory
+    name = os.path.normpath(member.name)
+    if name.startswith(execution_name + "/") == False or ".." in name.split("/"):
+        raise RetentionException("Unexpected member %s in the archive of %s" \
+                                 % (member.name,execution_name))
+    return name[len(execution_name) + 1:]
+
+def restore(execution_name,log_dir=LOG_DIR):
+    """extract a compressed execution back into its directory and remove its archive
+
+       A resumed execution writes to a new directory next to its archive. The files
+       of that directory are kept over the archived ones, except the journal whose
+       archived records are put in front of the new ones.
+
+       Returns:
+           True when an archive was restored, False when the execution has none
+    """
+    archive = _archive_path(log_dir,execution_name)
+    if os.path.isfile(archive) == False:
+        return False
+    path = os.path.join(log_dir,execution_name)
+    tar  = tarfile.open(archive,"r:gz")
+    try:
+        for member in tar.getmembers():
+            if member.isfile() == False:
+                continue
+            target = os.path.join(path,_member_name(execution_name,member))
+            data   = tar.extractfile(member).read()
+            if os.path.basename(target) == "journal" and os.path.isfile(target):
+                if data != "" and data.endswith("\n") == False:
+                    # a torn last record stays on a line of its own
+                    data = data + "\n"
+                with open(target) as f:
+                    data = data + f.read()
+            elif os.path.exists(target):
+                continue
+            if os.path.isdir(os.path.dirname(target)) == False:
+                os.makedirs(os.path.dirname(target))
+            with open(target + ".tmp","w") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.rename(target + ".tmp",target)
+    finally:
+        tar.close()
+    os.remove(archive)
+    return True
+
+def compress(execution_name,log_dir=LOG_DIR):
+    """compress a finished execution directory into logs/$execution_name.tar.gz
+
+       The directory is indexed, archived to a temporary file renamed into place
+       and only then removed, so an interruption never loses a transcript. The
+       directory of an execution resumed after it was compressed is first merged
+       with the existing archive, see restore.
+
+       Returns:
+           The list of index entries of the execution
+    """
+    path = os.path.join(log_dir,execution_name)
+    if os.path.isdir(path) == False:
+        raise RetentionException("No execution directory %s" % path)
+    restore(execution_name,log_dir)
+    entries  = scan(execution_name,log_dir)
+    tmp_path = _archive_path(log_dir,execution_name) + ".tmp"
+    tar = tarfile.open(tmp_path,"w:gz")
+    try:
+        tar.add(path,arcname=execution_name)
+    finally:
+        tar.close()
+    os.rename(tmp_path,_archive_path(log_dir,execution_name))
+    _append_index(entries,log_dir)
+    shutil.rmtree(path)
+    return entries
+
+def compress_finished(log_dir=LOG_DIR,idle=FINISHED_AFTER):
+    """compress every finished execution directory
+
+       Returns:
+           The list of the compressed execution names
+    """
+    done = []
+    for execution_name in executions(log_dir):
+        if finished(execution_name,log_dir,idle):
+            compress(execution_name,log_dir)
+            done.append(execution_name)
+    return done
+
+def enforce(max_age_days=MAX_AGE_DAYS,max_bytes=MAX_BYTES,log_dir=LOG_DIR):
+    """delete the compressed executions past the age budget, then the oldest ones
+       until the archives fit in the size budget
+
+       Returns:
+           The list of the deleted execution names
+    """
+    dated = sorted([(execution_time(name,_archive_path(log_dir,name)),name) \
+                    for name in archives(log_dir)])
+    sizes = dict([(name,os.path.getsize(_archive_path(log_dir,name))) for t,name in dated])
+    total = sum(sizes.values())
+    limit = time.time() - max_age_days * 86400
+    deleted = []
+    for t,name in dated:
+        if t >= limit and total <= max_bytes:
+            break
+        os.remove(_archive_path(log_dir,name))
+        total = total - sizes[name]
+        deleted.append(name)
+    if deleted != []:
+        _rewrite_index([entry for entry in load_index(log_dir) \
+                        if entry["execution"] not in deleted],log_dir)
+    return deleted
+
+def query(device=None,exception=None,level=None,since=None,until=None,log_dir=LOG_DIR):
+    """look up the index without touching the archives
+
+       Args:
+           device    : a string holding the device name, any device when None
+           exception : a string holding the exception type, e.g. LoginException
+           level     : a string holding the log level, e.g. ERROR
+           since     : an epoch time, the executions started before it are skipped
+           until     : an epoch time, the executions started after it are skipped
+
+       The executions not compressed yet are scanned on the fly, they are the few
+       recent ones.
+
+       Returns:
+           A list of the matching index entries ordered by time
+    """
+    entries = load_index(log_dir)
+    for execution_name in executions(log_dir):
+        start = execution_time(execution_name,os.path.join(log_dir,execution_name))
+        if (since is None or start >= since) and (until is None or start <= until):
+            entries = entries + scan(execution_name,log_dir)
+    return [entry for entry in entries \
+            if (device is None or entry["device"] == device) \
+            and (exception is None or entry["exception"] == exception) \
+            and (level is None or entry["level"] == level) \
+            and (since is None or entry["time"] >= since) \
+            and (until is None or entry["time"] <= until)]
+
+def read(execution_name,filename,log_dir=LOG_DIR):
+    """return the content of a file of an execution, e.g. 5R3.stdout, compressed or not"""
+    path = os.path.join(log_dir,execution_name,filename)
+    if os.path.isfile(path):
+        with open(path) as f:
+            return f.read()
+    return read_archived(execution_name,filename,log_dir)
+
+def read_archived(execution_name,filename,log_dir=LOG_DIR):
+    """return the content of a file of a compressed execution
+
+       Raises:
+           RetentionException : the execution has no archive or no such file
+    """
+    if os.path.isfile(_archive_path(log_dir,execution_name)) == False:
+        raise RetentionException("No execution %s" % execution_name)
+    tar = tarfile.open(_archive_path(log_dir,execution_name),"r:gz")
+    try:
+        member = tar.extractfile(execution_name + "/" + filename)
+        return member.read()
+    except KeyError:
+        raise RetentionException("No file %s in execution %s" % (filename,execution_name))
+    finally:
+        tar.close()
+
+def _date(s):
+    return time.mktime(datetime.datetime.strptime(s,"%Y-%m-%d").timetuple())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("action",choices=["compress","enforce","query"])
+    parser.add_argument("--device")
+    parser.add_argument("--exception")
+    parser.add_argument("--level")
+    parser.add_argument("--since",type=_date,help="YYYY-MM-DD")
+    parser.add_argument("--until",type=_date,help="YYYY-MM-DD")
+    parser.add_argument("--max-age-days",type=int,default=MAX_AGE_DAYS)
+    parser.add_argument("--max-bytes",type=int,default=MAX_BYTES)
+    args = parser.parse_args()
+
+    if args.action == "compress":
+        for execution_name in compress_finished():
+            print "Compressed %s" % execution_name
+    elif args.action == "enforce":
+        for execution_name in enforce(args.max_age_days,args.max_bytes):
+            print "Deleted %s" % execution_name
+    else:
+        for entry in query(args.device,args.exception,args.level,args.since,args.until):
+            print "%-14s %-6s %-8s %-24s %s" % (entry["execution"],entry["device"],
+                                               entry["level"],entry["exception"],entry["count"])
@@ -0,0 +1,87 @@
+#!/usr/bin/python
+
+import os
+import json
+
+PROFILE_DIR = "profiles"
+
+# Weight of the newest sample in the latency moving average
+LATENCY_ALPHA = 0.3
+
+class SessionProfile(object):
+    """SessionProfile holds what was learned about a device on previous runs
+
+    The profile is persisted as profiles/<device>.json and lets login, enable and
+    reset go straight to the path that worked last time. A field left to None has
+    not been learned yet and the caller falls back to discovery, as it does when
+    the learned value turns out to be wrong.
+
+    Attributes:
+        _name      : a string holding the device name
+        _path      : a string holding the path of the profile file
+        _fields    : a dictionary holding the learned facts
+                     enable_passwd : the enable password which worked, "" when none was asked
+                     is_switch     : a boolean, True when the device is a switch
+                     controller    : a boolean, True when the console showed a wireless
+                                     controller prompt
+                     latency       : a float holding the moving average of the seconds
+                                     between a return character and the login prompt,
+                                     it shortens the login timeout of the next runs
+                     timeouts      : a dictionary of operation to the latency stats of
+                                     the device, see timeouts.LatencyTracker.export
+                     logins        : an integer counting the successful logins
+        _dirty     : a boolean, True when the fields changed since the last save
+    """
+
+    def __init__(self,name,profile_dir=PROFILE_DIR):
+        self._name   = name
+        self._path   = os.path.join(profile_dir,name + ".json")
+        self._fields = {"enable_passwd" : None,
+                        "is_switch"     : None,
+                        "controller"    : None,
+                        "latency"       : None,
+                        "timeouts"      : {},
+                        "logins"        : 0}
+        self._dirty  = False
+        if os.path.isfile(self._path):
+            try:
+                with open(self._path) as f:
+                    self._fields.update(json.load(f))
+            except ValueError:
+                # a corrupted profile is relearned from scratch
+                pass
+
+    @property
+    def known(self):
+        return self._fields["logins"] > 0
+
+    def get(self,field):
+        return self._fields.get(field)
+
+    def update(self,field,value):
+        if self._fields.get(field) != value:
+            self._fields[field] = value
+            self._dirty = True
+
+    def forget(self,field):
+        """drop a learned value which turned out to be wrong"""
+        self.update(field,None)
+
+    def observe_latency(self,seconds):
+        latency = self._fields["latency"]
+        if latency is None:
+            self.update("latency",seconds)
+        else:
+            self.update("latency",LATENCY_ALPHA * seconds + (1 - LATENCY_ALPHA) * latency)
+
+    def save(self):
+        """write the profile to disk if anything changed"""
+        if self._dirty == False:
+            return
+        if os.path.isdir(os.path.dirname(self._path)) == False:
+            os.makedirs(os.path.dirname(self._path))
+        tmp_path = self._path + ".tmp"
+        with open(tmp_path,"w") as f:
+            json.dump(self._fields,f)
+        os.rename(tmp_path,self._path)
+        self._dirty = False
@@ -0,0 +1,265 @@
+#!/usr/bin/python
+
+import os
+import re
+import gc
+import sys
+import random
+import shutil
+import logging
+import tempfile
+import pexpect
+import device
+import timeouts
+import dashboard
+
+# Output returned by the simulated devices for the commands they know
+OUTPUTS = {"show version" : "Cisco IOS Software, C2800 Software (C2800NM-ADVIPSERVICESK9-M), "
+                            "Version 12.4(24)T, RELEASE SOFTWARE (fc1)\r\n"
+                            "%(name)s uptime is 2 weeks, 3 days, 4 hours, 5 minutes\r\n"
+                            "System image file is \"flash:c2800nm-advipservicesk9-mz.124-24.T.bin\"\r\n"
+                            "Cisco 2811 (revision 53.51) with 251904K/10240K bytes of memory.\r\n"
+                            "Processor board ID FTX1234A5BC\r\n"
+                            "Configuration register is 0x2102\r\n",
+           "show run"          : "Building configuration...\r\n\r\n"
+                                 "version 12.4\r\n"
+                                 "hostname %(name)s\r\n"
+                                 "!\r\n"
+                                 "interface FastEthernet0/0\r\n"
+                                 " no ip address\r\n"
+                                 "!\r\n"
+                                 "end\r\n",
+           "terminal length 0" : ""}
+
+class VirtualClock(object):
+    """VirtualClock is the time seen by the simulated consoles, advanced by their expects"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self,seconds):
+        self.now = self.now + seconds
+
+class SimulatedConsole(object):
+    """SimulatedConsole stands in for the pexpect.spawn object of a device
+
+    Every line sent is answered with its echo, the output of the command and a new
+    privileged prompt after a latency drawn from the latency function of the device.
+    Time is virtual: an expect advances the clock to the next answer or by its timeout,
+    so a simulated sweep of idle timeouts runs in no time.
+
+    Attributes:
+        name     : a string holding the device name used in the prompt
+        clock    : the VirtualClock object shared by the consoles of a simulation
+        latency  : a function returning the seconds before the next answer
+        buffer   : a string holding the received output not matched yet
+        before   : a string holding the output before the last match
+        after    : a string holding the last match
+        pending  : a list of (ready time,text) answers still on their way
+    """
+
+    def __init__(self,name,clock,latency,outputs=OUTPUTS):
+        self.name     = name
+        self.clock    = clock
+        self.latency  = latency
+        self.outputs  = outputs
+        self.buffer   = ""
+        self.before   = ""
+        self.after    = ""
+        self.pending  = []
+        self.logfile_read = None
+
+    def send(self,s):
+        for line in s.split("\r")[:-1]:
+            ready  = self.clock() + self.latency()
+            output = self.outputs.get(line.strip(),"") % {"name" : self.name}
+            self.pending.append((ready,line + "\r\n" + output + self.name + "#"))
+        self.pending.sort()
+
+    def expect(self,pattern,timeout=-1):
+        if timeout == -1 or timeout is None:
+            timeout = 30
+        patterns = pattern if isinstance(pattern,list) else [pattern]
+        deadline = self.clock() + timeout
+        while True:
+            for index,p in enumerate(patterns):
+                if p in [pexpect.TIMEOUT,pexpect.EOF]:
+                    continue
+                m = (p if hasattr(p,"search") else re.compile(p)).search(self.buffer)
+                if m is not None:
+                    self.before = self.buffer[:m.start()]
+                    self.after  = m.group(0)
+                    self.buffer = self.buffer[m.end():]
+                    return index
+            if self.pending == [] or self.pending[0][0] > deadline:
+                self.clock.advance(max(0.0,deadline - self.clock()))
+                self.after = pexpect.TIMEOUT
+                if pexpect.TIMEOUT in patterns:
+                    return patterns.index(pexpect.TIMEOUT)
+                raise pexpect.TIMEOUT("Timeout exceeded in simulated expect")
+            ready,text = self.pending.pop(0)
+            self.clock.advance(max(0.0,ready - self.clock()))
+            self.buffer = self.buffer + text
+
+    def terminate(self,force=False):
+        return True
+
+    def close(self,force=True):
+        self.buffer  = ""
+        self.pending = []
+
+def fast_latency():
+    return random.lognormvariate(-3.0,0.5)
+
+def slow_latency():
+    # an ISR behind a congested terminal server, with the odd very long stall
+    if random.random() < 0.02:
+        return random.uniform(30,45)
+    return random.lognormvariate(0.5,0.6)
+
+def simulated_fleet(clock,fast=30,slow=10,tracker=None):
+    """build devices attached to simulated consoles
+
+       Returns:
+           A list of device objects, logged in and privileged
+    """
+    devices = []
+    for i in range(fast + slow):
+        name = "%dR%d" % (i / 4 + 1,i % 4 + 1)
+        dev  = device.Device([name,("simulator",str(2000 + i))],tracker=tracker)
+        dev.logger = logging.getLogger("simulator." + name)
+        dev.proc   = SimulatedConsole(name,clock,fast_latency if i < fast else slow_latency)
+        dev.mode   = device.PRIVILEGED
+        devices.append(dev)
+    return devices
+
+def latency_report(commands=50,seed=1):
+    """compare the per-command latency with fixed and with adaptive timeouts
+
+       Every simulated device runs show version in the accurate send_cmd mode, which
+       waits for an idle interval after the output. With fixed timeouts every command
+       pays the 5 second interval and slow answers past 5 seconds come back empty; with
+       adaptive timeouts both are derived from the observed latency.
+
+       Returns:
+           A dictionary of mode to its (p50,p95,p99) command latency and failure count
+    """
+    logging.getLogger("simulator").addHandler(logging.NullHandler())
+    logging.getLogger("simulator").propagate = False
+    report = {}
+    for mode in ["fixed","adaptive"]:
+        random.seed(seed)
+        clock   = VirtualClock()
+        tracker = timeouts.LatencyTracker(enabled=(mode == "adaptive"),clock=clock)
+        samples = []
+        failures = 0
+        for dev in simulated_fleet(clock,tracker=tracker):
+            for i in range(commands):
+                start = clock()
+                try:
+                    output = dev.send_cmd("show version")
+                except device.ExecuteCMDException:
+                    output = ""
+                if output.find("uptime") == -1:
+                    # timed out before the answer, drop it so it does not leak into the next
+                    failures = failures + 1
+                    dev.proc.pending = []
+                    dev.proc.buffer  = ""
+                samples.append(clock() - start)
+        report[mode] = (timeouts.percentiles(samples),failures)
+    return report
+
+def timeout_check():
+    """check that a long command is not timed out by what a short one taught
+
+       A device answers show version fast until its timeouts are learned, then the
+       show run of save_config takes 4 seconds. The learned timeouts are per command,
+       so show run keeps its default until it has samples of its own.
+
+       Returns:
+           True when the show run output was captured in both send_cmd modes
+    """
+    logging.getLogger("simulator").addHandler(logging.NullHandler())
+    logging.getLogger("simulator").propagate = False
+    clock   = VirtualClock()
+    tracker = timeouts.LatencyTracker(clock=clock)
+    dev     = simulated_fleet(clock,fast=1,slow=0,tracker=tracker)[0]
+    dev.proc.latency = lambda: 0.05
+    for i in range(2 * timeouts.MIN_SAMPLES):
+        dev.send_cmd("show version",max_performance=True)
+        dev.send_cmd("show version")
+    dev.proc.latency = lambda: 4.0
+    try:
+        fast     = dev.send_cmd("show run",max_performance=True)
+        accurate = dev.send_cmd("show run")
+    except device.ExecuteCMDException:
+        return False
+    return fast.find("hostname") != -1 and accurate.find("hostname") != -1
+
+def rss():
+    """return the resident set size of the process in bytes"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except IOError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def memory_report(devices=10000,sweeps=5):
+    """sweep a large simulated fleet repeatedly and record the memory after each sweep
+
+       Every sweep builds the devices one at a time, as inwk streams them, and runs
+       them through pre_process, a show version, disconnect and post_process. The
+       devices are released by post_process, so after the first sweep has warmed up
+       the shared state (latency tracker, dashboard) the memory must stay flat.
+
+       Returns:
+           A list of the resident set sizes in bytes, one per sweep
+    """
+    cwd = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    os.chdir(work_dir)
+    try:
+        clock   = VirtualClock()
+        tracker = timeouts.LatencyTracker(clock=clock)
+        board   = dashboard.Dashboard([])
+        samples = []
+        for sweep in range(sweeps):
+            for i in range(devices):
+                name = "%dR%d" % (i / 4 + 1,i % 4 + 1)
+                dev  = device.Device([name,("simulator",str(2000 + i % 100))],"memory",
+                                     tracker=tracker,dashboard=board)
+                dev.pre_process()
+                dev.outfd = open(os.devnull,"w")
+                dev.proc  = SimulatedConsole(name,clock,fast_latency)
+                dev.mode  = device.PRIVILEGED
+                dev.send_cmd("show version",max_performance=True)
+                dev.disconnect()
+                dev.post_process()
+            gc.collect()
+            samples.append(rss())
+        return samples
+    finally:
+        os.chdir(cwd)
+        shutil.rmtree(work_dir)
+
+if __name__ == "__main__":
+    if sys.argv[1:] == ["timeouts"]:
+        # regression check of the per command timeouts
+        ok = timeout_check()
+        print "show run after a learned show version : %s" % ("ok" if ok else "timed out")
+        sys.exit(0 if ok else 1)
+    if sys.argv[1:] == ["memory"]:
+        # memory regression check, fails when the memory grows after the first sweep
+        samples = memory_report()
+        for sweep,size in enumerate(samples):
+            print "sweep %s : rss %.1f MB" % (sweep + 1,size / 1048576.0)
+        growth = float(samples[-1] - samples[0]) / samples[0]
+        print "growth after the first sweep : %.1f%%" % (growth * 100)
+        sys.exit(1 if growth > 0.05 else 0)
+    for mode,(points,failures) in sorted(latency_report().items(),reverse=True):
+        print "%-8s : p50 %6.2fs  p95 %6.2fs  p99 %6.2fs  failures %s" \
+              % (mode,points[0],points[1],points[2],failures)
@@ -0,0 +1,293 @@
+#!/usr/bin/python
+
+import os
+import re
+import sys
+import stat
+import time
+import shutil
+import pexpect
+import tempfile
+import threading
+import subprocess
+
+# Host key policy of the connections, see StrictHostKeyChecking in ssh_config(5):
+# accept-new records the key of a device seen for the first time and refuses a
+# changed one
+HOST_KEY_CHECKING  = "accept-new"
+HOST_KEY_POLICIES  = ["yes","accept-new","no"]
+
+# Seconds an idle control master is kept once its last session is closed
+CONTROL_PERSIST = 600
+
+# Compiled regular expression matching the replies of IOS to a command it refused, the
+# exec channel still exits 0 with them
+ios_error_re = re.compile("^[ \t]*%[ \t]*(Invalid[ \t]+input|Incomplete[ \t]+command|"
+                          "Ambiguous[ \t]+command|Unknown[ \t]+command|Authorization[ \t]+failed|"
+                          "This[ \t]+command[ \t]+is[ \t]+not[ \t]+authorized)",re.M)
+
+class SSHTransportException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def control_dir(path=None):
+    """return the directory of the control master sockets, created if needed
+
+       The sockets give a password-less access to the devices, so they live in a
+       directory of the current user which nobody else can open, by default
+       inwk-ssh-$uid in the temporary directory rather than /tmp itself.
+
+       Raises:
+           SSHTransportException : the directory is owned by another user or is
+                                   open to other users
+    """
+    if path is None:
+        path = os.path.join(tempfile.gettempdir(),"inwk-ssh-%s" % os.getuid())
+    try:
+        os.mkdir(path,0700)
+    except OSError:
+        # created by an earlier connection, checked below
+        pass
+    st = os.lstat(path)
+    if stat.S_ISDIR(st.st_mode) == False or st.st_uid != os.getuid() \
+            or st.st_mode & (stat.S_IRWXG | stat.S_IRWXO) != 0:
+        raise SSHTransportException("Control directory %s must be a directory of user %s "
+                                    "with mode 0700" % (path,os.getuid()))
+    return path
+
+class SSHConnection(object):
+    """SSHConnection is one authenticated ssh connection to the management ip of a device
+
+    The connection is an OpenSSH control master: the password is typed once when the
+    master is spawned and every later session rides on it as a new channel, without
+    any new handshake or authentication. run() opens an exec channel per command, so
+    several commands can run in parallel on the same device and their output moves at
+    network speed. shell() opens an interactive channel which stands in for the
+    console session of Device.login.
+
+    The master outlives its sessions for CONTROL_PERSIST seconds only, so a master
+    left behind by a crashed run does not stay open.
+
+    The exec channels never go through enable: a command runs at the privilege
+    level of the ssh user, which must be privilege 15 (username ... privilege 15)
+    for show running-config and the like. A command IOS refused is reported as a
+    failure rather than returned as its output.
+
+    Attributes:
+        _host         : a string holding the management ip or name of the device
+        _port         : an integer holding the ssh port
+        _username     : a string holding the ssh username
+        _password     : a string holding the ssh password
+        _ssh_command  : a string holding the ssh client binary, e.g. to test against a
+                        local sshd with a wrapper script
+        _host_key     : a string holding the StrictHostKeyChecking policy, one of
+                        HOST_KEY_POLICIES
+        _known_hosts  : a string holding the known hosts file, None for the default
+                        one of the user
+        _control_path : a string holding the path of the control master socket
+        _channels     : a threading.Semaphore bounding the concurrent channels, as the
+                        devices only offer a few vty lines
+    """
+
+    def __init__(self,host,username,password,port=22,max_channels=4,ssh_command="ssh",
+                 host_key_checking=HOST_KEY_CHECKING,known_hosts=None,control_path_dir=None):
+        if host_key_checking not in HOST_KEY_POLICIES:
+            raise SSHTransportException("Unknown host key policy %s" % host_key_checking)
+        self._host         = host
+        self._port         = int(port)
+        self._username     = username
+        self._password     = password
+        self._ssh_command  = ssh_command
+        self._host_key     = host_key_checking
+        self._known_hosts  = known_hosts
+        self._control_path = os.path.join(control_dir(control_path_dir),"%s@%s-%s" \
+                                          % (username,host,self._port))
+        self._channels     = threading.Semaphore(max_channels)
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def control_path(self):
+        return self._control_path
+
+    def _args(self,*extra):
+        args = [self._ssh_command,"-p",str(self._port),"-o","ControlPath=" + self._control_path,
+                "-o","StrictHostKeyChecking=" + self._host_key]
+        if self._known_hosts is not None:
+            args.extend(["-o","UserKnownHostsFile=" + self._known_hosts])
+        return args + ["-l",self._username] + list(extra)
+
+    def connected(self):
+        """return True when the control master is up"""
+        with open(os.devnull,"w") as devnull:
+            return subprocess.call(self._args("-O","check",self._host),
+                                   stdout=devnull,stderr=devnull) == 0
+
+    def connect(self,timeout=30):
+        """spawn the control master and authenticate it
+
+           A failed or interrupted connection does not leave a master behind.
+
+           Raises:
+               SSHTransportException : the authentication or the connection failed
+        """
+        if self.connected():
+            return 0
+        args   = self._args("-M","-N","-f","-o","ControlPersist=%s" % CONTROL_PERSIST,
+                            self._host)
+        master = pexpect.spawn(args[0],args[1:])
+        try:
+            index = master.expect(["assword:",pexpect.EOF,pexpect.TIMEOUT],timeout=timeout)
+            if index == 0:
+                master.send(self._password + "\r")
+                index = master.expect(["assword:",pexpect.EOF,pexpect.TIMEOUT],timeout=timeout)
+            if index != 1 or self.connected() == False:
+                raise SSHTransportException("Unable to open ssh connection to %s" % self._host)
+        except:
+            master.terminate(True)
+            self.close()
+            raise
+        return 0
+
+    def run(self,command,timeout=60):
+        """run a command on its own exec channel and return its output
+
+           Raises:
+               SSHTransportException : the channel could not be opened, timed out or
+                                       the device refused the command, e.g. for lack
+                                       of privilege
+        """
+        with self._channels:
+            proc = subprocess.Popen(self._args("-T",self._host,command),
+                                    stdout=subprocess.PIPE,stderr=subprocess.STDOUT)
+            timer = threading.Timer(timeout,proc.kill)
+            timer.start()
+            try:
+                output = proc.communicate()[0]
+            finally:
+                timer.cancel()
+        if proc.returncode != 0:
+            raise SSHTransportException("Command %s failed on %s with code %s" \
+                                        % (command,self._host,proc.returncode))
+        m = ios_error_re.search(output)
+        if m is not None:
+            raise SSHTransportException("Command %s refused by %s : %s" \
+                                        % (command,self._host,output[m.start():].split("\n")[0]))
+        return output
+
+    def run_many(self,commands,timeout=60):
+        """run several commands in parallel channels, returns their outputs in order
+
+           Raises:
+               SSHTransportException : when any of the commands failed
+        """
+        outputs = [None] * len(commands)
+        errors  = []
+        def worker(i):
+            try:
+                outputs[i] = self.run(commands[i],timeout)
+            except SSHTransportException as e:
+                errors.append(e)
+        threads = [threading.Thread(target=worker,args=(i,)) for i in range(len(commands))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        if errors != []:
+            raise errors[0]
+        return outputs
+
+    def shell(self):
+        """open an interactive channel, returns its pexpect.spawn object"""
+        args = self._args("-tt",self._host)
+        return pexpect.spawn(args[0],args[1:])
+
+    def close(self):
+        """tear the control master down"""
+        with open(os.devnull,"w") as devnull:
+            subprocess.call(self._args("-O","exit",self._host),stdout=devnull,stderr=devnull)
+
+# Stand-in for the ssh client and the sshd of a device, used by the self check: the
+# control master is a plain file at the ControlPath and every exec channel takes a second
+FAKE_SSH = """#!/bin/bash
+echo "$*" >> "%(log)s"
+ctl=$(echo "$*" | sed 's/.*ControlPath=\\([^ ]*\\).*/\\1/')
+case "$*" in
+  *"-O check"*) [ -e "$ctl" ] ;;
+  *"-O exit"*) rm -f "$ctl" ;;
+  *" -M "*) read -s -p "Password:" pw; echo; [ "$pw" = "%(password)s" ] && touch "$ctl" ;;
+  *" -T "*"show running-config") [ -e "$ctl" ] || exit 255
+                                  echo "                    ^"
+                                  echo "%% Invalid input detected at '^' marker." ;;
+  *" -T "*) [ -e "$ctl" ] || exit 255; sleep 1; echo "output of ${@: -1}" ;;
+esac
+"""
+
+if __name__ == "__main__":
+    # self check against the stand-in: a refused password leaves no master behind, the
+    # channels run in parallel on one master, the master is finite, a command refused
+    # by the device fails and the sockets are private to the user
+    work_dir = tempfile.mkdtemp()
+    failures = []
+    try:
+        script  = os.path.join(work_dir,"ssh")
+        log     = os.path.join(work_dir,"ssh.log")
+        sockets = os.path.join(work_dir,"sockets")
+        with open(script,"w") as f:
+            f.write(FAKE_SSH % {"log" : log,"password" : "secret"})
+        os.chmod(script,0700)
+
+        refused = SSHConnection("10.0.0.1","lab","wrong",ssh_command=script,
+                                control_path_dir=sockets)
+        if os.stat(sockets).st_mode & 0777 != 0700:
+            failures.append("control directory is not private")
+        try:
+            refused.connect(timeout=5)
+            failures.append("wrong password accepted")
+        except SSHTransportException:
+            pass
+        if os.path.exists(refused.control_path):
+            failures.append("master left behind a refused connection")
+
+        conn = SSHConnection("10.0.0.1","lab","secret",ssh_command=script,
+                             control_path_dir=sockets)
+        conn.connect(timeout=5)
+        commands = ["show version","show clock","show users","show ip route"]
+        start    = time.time()
+        outputs  = conn.run_many(commands)
+        elapsed  = time.time() - start
+        print "%s channels in %.2fs" % (len(commands),elapsed)
+        if outputs != ["output of %s\n" % command for command in commands]:
+            failures.append("unexpected outputs %s" % outputs)
+        if elapsed >= 2:
+            failures.append("channels did not run in parallel")
+        with open(log) as f:
+            master = [line for line in f if " -M " in line][-1]
+        if "ControlPersist=%s " % CONTROL_PERSIST not in master:
+            failures.append("master is not finite : %s" % master.strip())
+        if "StrictHostKeyChecking=%s " % HOST_KEY_CHECKING not in master:
+            failures.append("host key policy not applied : %s" % master.strip())
+        try:
+            conn.run("show running-config")
+            failures.append("output of a command refused for lack of privilege accepted")
+        except SSHTransportException:
+            pass
+        conn.close()
+        if conn.connected():
+            failures.append("master still up after close")
+
+        os.chmod(sockets,0755)
+        try:
+            control_dir(sockets)
+            failures.append("control directory open to other users accepted")
+        except SSHTransportException:
+            pass
+    finally:
+        shutil.rmtree(work_dir)
+    for failure in failures:
+        print "FAILED : %s" % failure
+    sys.exit(1 if failures else 0)
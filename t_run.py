@@ -1,19 +1,52 @@
 import data.data_fetcher
 import device
+import journal
+import preflight
+import dashboard
+import watcher
 import time
+import datetime
 import Queue
 import threading
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--resume",metavar="EXECUTION_NAME",default="",
+                    help="skip the devices which completed in the given execution")
+args = parser.parse_args()
+
+if args.resume == "":
+    execution_name = datetime.datetime.now().strftime("%Y-%m-%d-%H")
+    finished = set()
+else:
+    execution_name = args.resume
+    finished = journal.completed(execution_name)
+    print "Resuming %s, skipping %s completed devices" % (execution_name,len(finished))
 
 my_data_list = data.data_fetcher.get_pod_routers([1,2,3,4,5,6,7,8,9],[1,2,3,4])
 my_data_list = my_data_list + data.data_fetcher.get_pod_switches([1,2,3,4,5,6,7,8,9],[1])
 
+my_data_list = [i for i in my_data_list if i[0] not in finished]
+
+run_journal = journal.Journal(execution_name)
+
+my_data_list,dead = preflight.live(my_data_list)
+for name,state in sorted(dead.items()):
+    print "Skipping %s, its console line is %s" % (name,state)
+    run_journal.record(name,"preflight",journal.FAILED,state)
+
+board = dashboard.Dashboard([i[0] for i in my_data_list])
+
 my_device_list = []
 
 for i in my_data_list:
-    my_device_list.append(device.Device(i))
+    my_device_list.append(device.Device(i,execution_name,dashboard=board))
 
 queue = Queue.Queue()
 
+# one watcher follows the boot of every reloaded device, the workers move on
+reload_watcher = watcher.ReloadWatcher(username="username",password="password")
+
 class ThreadDevice(threading.Thread):
     
     def __init__(self,queue):
@@ -22,20 +55,30 @@ class ThreadDevice(threading.Thread):
 
     def run(self):
         while True:
+            handed = False
             try:
                 device = self.queue.get()
-                device.pre_process()
-                device.login("username","password")
-                device.enable()
-                device.reset()
-                device.disconnect()
-                device.post_process()
+                handed = watcher.run_stages(reload_watcher,run_journal,device,
+                                            [("pre_process",device.pre_process),
+                                             ("login",lambda: device.login("username","password")),
+                                             ("enable",device.enable),
+                                             ("reset",device.reset),
+                                             ("watch_reload",None),
+                                             ("disconnect",device.disconnect),
+                                             ("post_process",device.post_process)],
+                                            board)
             except:
                 continue
             finally:
+                # a failed stage skipped post_process, a handed over device is
+                # released by the watcher
+                if not handed:
+                    device.release()
                 self.queue.task_done()
 
 start = time.time()
+board.start()
+reload_watcher.start()
 
 for i in range(10):
     t = ThreadDevice(queue)
@@ -46,5 +89,8 @@ for device in my_device_list:
     queue.put(device)
 
 queue.join()
+reload_watcher.stop()
+board.stop()
+run_journal.close()
 
 print "Elapsed Time : %s" %(time.time() - start)
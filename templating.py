@@ -0,0 +1,165 @@
+#!/usr/bin/python
+
+import os
+import sys
+import string
+import shutil
+import tempfile
+import threading
+import data.data_fetcher
+import device
+
+TEMPLATE_DIR = "templates"
+
+class TemplateException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+class ConfigTemplate(string.Template):
+    """ConfigTemplate is a string.Template which only substitutes braced ${variables}
+
+    A bare $ is left alone: IOS configs hold it in secrets such as
+    "enable secret 5 $1$mERr$hx5rVt7rPNoS4wqbXKX7m0" and in banners, where the
+    $word placeholders of string.Template would fail or be taken for variables.
+    """
+
+    pattern = r"""
+    \$(?:
+      (?P<escaped>(?!))                      |  # nothing to escape, $ is literal
+      (?P<named>(?!))                        |  # bare $word is literal too
+      \{(?P<braced>[_a-zA-Z][_a-zA-Z0-9]*)\} |
+      (?P<invalid>(?!))
+    )
+    """
+
+class Renderer(object):
+    """Renderer renders the per-role configuration templates for a fleet of devices
+
+    A template is a config file under templates/<role>.tmpl (router.tmpl, switch.tmpl)
+    with ${variables} substituted from data.data_fetcher.get_device_vars(). Parsed
+    templates are cached by path and re-read only when the file modification time
+    changes, rendered configs are cached as the filtered line lists push_config
+    sends, per device along with the template path, its modification time and the
+    variables they were rendered from, so a change to either renders the device again.
+
+    Attributes:
+        _template_dir : a string holding the directory of the templates
+        _templates    : a dictionary of template path to (mtime,ConfigTemplate)
+        _rendered     : a dictionary of device name to ((path,mtime,variables),rendered lines)
+        _lock         : a threading.Lock protecting the caches
+        _hits         : an integer counting the renders served from the cache
+        _misses       : an integer counting the renders which went through the template
+    """
+
+    def __init__(self,template_dir=TEMPLATE_DIR):
+        self._template_dir = template_dir
+        self._templates    = {}
+        self._rendered     = {}
+        self._lock         = threading.Lock()
+        self._hits         = 0
+        self._misses       = 0
+
+    def template_path(self,role):
+        return os.path.join(self._template_dir,role + ".tmpl")
+
+    def _template(self,path):
+        """return the (mtime,ConfigTemplate) of a template file, parsed once per mtime"""
+        if os.path.isfile(path) == False:
+            raise TemplateException("No template file %s" % path)
+        mtime  = os.path.getmtime(path)
+        cached = self._templates.get(path)
+        if cached is not None and cached[0] == mtime:
+            return cached
+        with open(path) as f:
+            cached = (mtime,ConfigTemplate(f.read()))
+        self._templates[path] = cached
+        return cached
+
+    def render(self,device_name,overrides=None):
+        """render the config of a device into the line list push_config expects
+
+           Args:
+               device_name : a string holding the device name
+               overrides   : a dictionary of variables overriding the inventory ones
+
+           Returns:
+               A list of configuration lines terminated with a return character
+
+           Raises:
+               TemplateException : the template is missing or a variable is undefined
+        """
+        variables = data.data_fetcher.get_device_vars(device_name)
+        variables.update(overrides or {})
+        path = self.template_path(variables.get("template",variables["role"]))
+
+        with self._lock:
+            mtime,template = self._template(path)
+            key = (path,mtime,tuple(sorted(variables.items())))
+            cached = self._rendered.get(device_name)
+            if cached is not None and cached[0] == key:
+                self._hits = self._hits + 1
+                return cached[1]
+            self._misses = self._misses + 1
+
+        try:
+            text = template.substitute(variables)
+        except KeyError as e:
+            raise TemplateException("Variable %s of template %s is undefined for %s" \
+                                    % (e.args[0],path,device_name))
+        except ValueError as e:
+            raise TemplateException("Template %s is invalid : %s" % (path,e))
+        lines = device.config_lines(text.splitlines())
+
+        with self._lock:
+            self._rendered[device_name] = (key,lines)
+        return lines
+
+    def render_fleet(self,device_names,overrides=None):
+        """render the configs of many devices in one batch
+
+           Args:
+               device_names : a list of device names
+               overrides    : a dictionary of device name to its variable overrides
+
+           Returns:
+               A dictionary of device name to its list of configuration lines
+        """
+        overrides = overrides or {}
+        return dict([(name,self.render(name,overrides.get(name))) for name in device_names])
+
+    def stats(self):
+        with self._lock:
+            return {"hits"      : self._hits,
+                    "misses"    : self._misses,
+                    "templates" : len(self._templates),
+                    "rendered"  : len(self._rendered)}
+
+def push_rendered(dev,renderer,overrides=None):
+    """render the config of a device and push it without any intermediate file"""
+    return dev.push_config(lines=renderer.render(dev.name,overrides))
+
+if __name__ == "__main__":
+    # self check: a secret and a literal $word render untouched, a missing variable fails
+    template_dir = tempfile.mkdtemp()
+    try:
+        with open(os.path.join(template_dir,"router.tmpl"),"w") as f:
+            f.write("hostname ${hostname}\n"
+                    "enable secret 5 $1$mERr$hx5rVt7rPNoS4wqbXKX7m0\n"
+                    "banner motd ^C pod ${pod} costs $5 ^C\n")
+        lines = Renderer(template_dir).render("5R3")
+        print "".join([line.replace("\r","\n") for line in lines]),
+        expected = ["hostname 5R3\r","enable secret 5 $1$mERr$hx5rVt7rPNoS4wqbXKX7m0\r",
+                    "banner motd ^C pod 5 costs $5 ^C\r"]
+        with open(os.path.join(template_dir,"switch.tmpl"),"w") as f:
+            f.write("hostname ${hostname}\nip default-gateway ${gateway}\n")
+        try:
+            Renderer(template_dir).render("5S1")
+            missing = False
+        except TemplateException as e:
+            print "missing variable : %s" % e
+            missing = True
+    finally:
+        shutil.rmtree(template_dir)
+    sys.exit(0 if lines == expected and missing else 1)
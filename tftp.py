@@ -0,0 +1,321 @@
+#!/usr/bin/python
+
+import os
+import socket
+import select
+import struct
+import threading
+import time
+import logging
+
+# TFTP opcodes (RFC 1350)
+RRQ   = 1
+WRQ   = 2
+DATA  = 3
+ACK   = 4
+ERROR = 5
+
+# TFTP error codes
+NOT_DEFINED    = 0
+FILE_NOT_FOUND = 1
+ACCESS_VIOLATION = 2
+ILLEGAL_OPERATION = 4
+
+BLOCK_SIZE = 512
+
+class TFTPException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+def _error_packet(code,message):
+    return struct.pack("!HH",ERROR,code) + message + "\0"
+
+class Transfer(object):
+    """Transfer holds one TFTP transfer on its own ephemeral socket (its TID)
+
+    Attributes:
+        sock     : the udp socket of the transfer
+        peer     : the (host,port) of the device
+        filename : a string holding the requested filename
+        block    : an integer holding the current block number
+        last     : a string holding the last packet sent, resent on timeout
+        sent     : a float holding the time the last packet was sent
+        retries  : an integer counting the retransmissions of the last packet
+        done     : a boolean set once the transfer completed or failed
+    """
+
+    def __init__(self,peer,filename):
+        self.sock     = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self.sock.bind(("",0))
+        self.peer     = peer
+        self.filename = filename
+        self.block    = 0
+        self.last     = ""
+        self.sent     = 0.0
+        self.retries  = 0
+        self.done     = False
+        self.started  = time.time()
+
+    def send(self,packet):
+        self.last    = packet
+        self.sent    = time.time()
+        self.retries = 0
+        self.sock.sendto(packet,self.peer)
+
+    def resend(self):
+        self.sent    = time.time()
+        self.retries = self.retries + 1
+        self.sock.sendto(self.last,self.peer)
+
+    def fail(self,code,message):
+        self.sock.sendto(_error_packet(code,message),self.peer)
+        self.done = True
+
+class ReadTransfer(Transfer):
+    """ReadTransfer serves a file to a device (copy tftp: running-config)"""
+
+    def __init__(self,peer,filename,data):
+        Transfer.__init__(self,peer,filename)
+        self.data  = data
+        self.block = 1
+        self.send_block()
+
+    def send_block(self):
+        offset = (self.block - 1) * BLOCK_SIZE
+        self.send(struct.pack("!HH",DATA,self.block & 0xffff) + \
+                  self.data[offset:offset + BLOCK_SIZE])
+
+    def handle(self,packet):
+        opcode,block = struct.unpack("!HH",packet[:4])
+        if opcode != ACK or block != self.block & 0xffff:
+            return
+        if self.block * BLOCK_SIZE > len(self.data):
+            self.done = True
+            return
+        self.block = self.block + 1
+        self.send_block()
+
+class WriteTransfer(Transfer):
+    """WriteTransfer receives a file from a device (copy running-config tftp:)"""
+
+    def __init__(self,peer,filename,path):
+        Transfer.__init__(self,peer,filename)
+        self.path   = path
+        self.chunks = []
+        self.send(struct.pack("!HH",ACK,0))
+
+    def handle(self,packet):
+        opcode,block = struct.unpack("!HH",packet[:4])
+        if opcode != DATA:
+            return
+        if block == self.block & 0xffff:
+            # the device did not get our ack, acknowledge the duplicate again
+            self.resend()
+            return
+        if block != (self.block + 1) & 0xffff:
+            return
+        self.block = self.block + 1
+        self.chunks.append(packet[4:])
+        self.send(struct.pack("!HH",ACK,block))
+        if len(packet) - 4 < BLOCK_SIZE:
+            self.done = True
+
+class TFTPServer(object):
+    """TFTPServer is a small concurrent TFTP server for bulk config transfers
+
+    The server listens on one udp port and runs every transfer on its own ephemeral
+    socket, all of them multiplexed from a single select loop running in a daemon
+    thread, so many devices can copy their configs at the same time. Read requests
+    are served from the files published with publish() or from read_root, write
+    requests are stored under write_root (the config archive by default).
+
+    Attributes:
+        _address    : a string holding the address the devices use to reach the server
+        _port       : an integer holding the udp port to listen on
+        _read_root  : a string holding the directory read requests are served from
+        _write_root : a string holding the directory write requests are stored under
+        _published  : a dictionary of filename to the data served for it
+        _transfers  : a dictionary of socket to its Transfer object
+        _received   : a dictionary of filename to the path of the completed write requests
+        _callback   : an optional function called with (filename,path,data) per received file
+        _timeout    : a float holding the seconds before a packet is retransmitted
+        _retries    : an integer holding the retransmissions before a transfer is dropped
+    """
+
+    def __init__(self,address,port=69,read_root="config",write_root="config_archive",
+                 callback=None,timeout=2.0,retries=5):
+        self._address    = address
+        self._port       = port
+        self._read_root  = read_root
+        self._write_root = write_root
+        self._published  = {}
+        self._transfers  = {}
+        self._received   = {}
+        self._callback   = callback
+        self._timeout    = timeout
+        self._retries    = retries
+        self._lock       = threading.Lock()
+        self._sock       = None
+        self._thread     = None
+        self._running    = False
+        self._logger     = logging.getLogger("tftp")
+
+    @property
+    def address(self):
+        return self._address
+
+    @property
+    def port(self):
+        return self._port
+
+    def url(self,filename):
+        """return the tftp url of a file as given to the copy command of a device"""
+        if self._port == 69:
+            return "tftp://%s/%s" % (self._address,filename)
+        return "tftp://%s:%s/%s" % (self._address,self._port,filename)
+
+    def publish(self,filename,data):
+        """serve data for the read requests of filename, without any file on disk"""
+        with self._lock:
+            self._published[filename] = data
+
+    def unpublish(self,filename):
+        with self._lock:
+            self._published.pop(filename,None)
+
+    def received(self,filename):
+        """return the path a completed write request of filename was stored to, or None"""
+        with self._lock:
+            return self._received.pop(filename,None)
+
+    def start(self):
+        self._sock = socket.socket(socket.AF_INET,socket.SOCK_DGRAM)
+        self._sock.setsockopt(socket.SOL_SOCKET,socket.SO_REUSEADDR,1)
+        self._sock.bind(("",self._port))
+        self._port    = self._sock.getsockname()[1]
+        self._running = True
+        self._thread  = threading.Thread(target=self.serve_forever)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        self._logger.info("TFTP server listening on port %s" % self._port)
+
+    def stop(self):
+        self._running = False
+        if self._thread is not None:
+            self._thread.join()
+        for sock in self._transfers.keys():
+            sock.close()
+        self._transfers = {}
+        self._sock.close()
+
+    def _safe_path(self,root,filename):
+        path = os.path.normpath(os.path.join(root,filename.lstrip("/")))
+        if os.path.commonprefix([path,os.path.normpath(root) + os.sep]) != \
+                os.path.normpath(root) + os.sep:
+            return None
+        return path
+
+    def _request(self,packet,peer):
+        opcode = struct.unpack("!H",packet[:2])[0]
+        fields = packet[2:].split("\0")
+        if opcode not in [RRQ,WRQ] or len(fields) < 2:
+            self._sock.sendto(_error_packet(ILLEGAL_OPERATION,"Illegal TFTP operation"),peer)
+            return
+        filename = fields[0]
+
+        if opcode == RRQ:
+            with self._lock:
+                data = self._published.get(filename)
+            if data is None:
+                path = self._safe_path(self._read_root,filename)
+                if path is None or os.path.isfile(path) == False:
+                    self._sock.sendto(_error_packet(FILE_NOT_FOUND,"File not found"),peer)
+                    return
+                with open(path,"rb") as f:
+                    data = f.read()
+            self._logger.info("Serving %s to %s" % (filename,peer[0]))
+            transfer = ReadTransfer(peer,filename,data)
+        else:
+            path = self._safe_path(self._write_root,filename)
+            if path is None:
+                self._sock.sendto(_error_packet(ACCESS_VIOLATION,"Access violation"),peer)
+                return
+            self._logger.info("Receiving %s from %s" % (filename,peer[0]))
+            transfer = WriteTransfer(peer,filename,path)
+        self._transfers[transfer.sock] = transfer
+
+    def _complete(self,transfer):
+        del self._transfers[transfer.sock]
+        transfer.sock.close()
+        if isinstance(transfer,WriteTransfer) and transfer.block > 0 and \
+                len(transfer.chunks) == transfer.block:
+            data = "".join(transfer.chunks)
+            if os.path.isdir(os.path.dirname(transfer.path)) == False:
+                os.makedirs(os.path.dirname(transfer.path))
+            with open(transfer.path,"wb") as f:
+                f.write(data)
+            with self._lock:
+                self._received[transfer.filename] = transfer.path
+            self._logger.info("Stored %s (%s bytes) in %.1f seconds" \
+                              % (transfer.path,len(data),time.time() - transfer.started))
+            if self._callback is not None:
+                self._callback(transfer.filename,transfer.path,data)
+
+    def serve_forever(self):
+        while self._running:
+            socks = [self._sock] + self._transfers.keys()
+            readable = select.select(socks,[],[],0.5)[0]
+            for sock in readable:
+                try:
+                    packet,peer = sock.recvfrom(BLOCK_SIZE + 4)
+                except socket.error:
+                    continue
+                if sock is self._sock:
+                    self._request(packet,peer)
+                    continue
+                transfer = self._transfers.get(sock)
+                if transfer is None or peer != transfer.peer or len(packet) < 4:
+                    continue
+                if struct.unpack("!H",packet[:2])[0] == ERROR:
+                    self._logger.error("Transfer of %s aborted by %s" \
+                                       % (transfer.filename,peer[0]))
+                    transfer.done = True
+                    transfer.chunks = []
+                else:
+                    transfer.handle(packet)
+                if transfer.done:
+                    self._complete(transfer)
+
+            now = time.time()
+            for transfer in self._transfers.values():
+                if now - transfer.sent < self._timeout:
+                    continue
+                if transfer.retries >= self._retries:
+                    self._logger.error("Transfer of %s to %s timed out" \
+                                       % (transfer.filename,transfer.peer[0]))
+                    transfer.fail(NOT_DEFINED,"Timeout")
+                    if isinstance(transfer,WriteTransfer):
+                        transfer.chunks = []
+                    self._complete(transfer)
+                else:
+                    transfer.resend()
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Serve config/ and receive into config_archive/")
+    parser.add_argument("address",help="address the devices use to reach this server")
+    parser.add_argument("--port",type=int,default=69)
+    parser.add_argument("--read-root",default="config")
+    parser.add_argument("--write-root",default="config_archive")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO,format='%(asctime)s - %(name)s - %(message)s')
+    server = TFTPServer(args.address,args.port,args.read_root,args.write_root)
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
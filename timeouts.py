@@ -0,0 +1,185 @@
+#!/usr/bin/python
+
+import time
+import array
+import threading
+
+# Number of samples kept per (device,operation) for the percentile
+WINDOW      = 64
+# Samples needed before the timeouts are derived from the observed latency
+MIN_SAMPLES = 5
+# Weight of the newest sample in the moving average
+EWMA_ALPHA  = 0.2
+# High percentile the timeouts are derived from
+PERCENTILE  = 0.99
+# Safety factor applied on the high percentile
+FACTOR      = 3.0
+# Newest samples per (device,operation) carried over to the next runs, see export()
+PERSISTED   = 16
+
+class _Stats(object):
+    """_Stats holds the latency samples of one (device,operation)
+
+    The samples are a ring of WINDOW doubles allocated up front rather than a deque
+    of float objects, so the stats of a large inventory have a fixed, small size.
+    """
+
+    __slots__ = ["ewma","samples","count","next"]
+
+    def __init__(self):
+        self.ewma    = None
+        self.samples = array.array("d",[0.0]) * WINDOW
+        self.count   = 0
+        self.next    = 0
+
+    def observe(self,seconds):
+        self.samples[self.next] = seconds
+        self.next  = (self.next + 1) % WINDOW
+        self.count = min(WINDOW,self.count + 1)
+        if self.ewma is None:
+            self.ewma = seconds
+        else:
+            self.ewma = EWMA_ALPHA * seconds + (1 - EWMA_ALPHA) * self.ewma
+
+    def percentile(self,p):
+        ordered = sorted(self.samples[:self.count])
+        return ordered[min(len(ordered) - 1,int(p * len(ordered)))]
+
+    def newest(self,n):
+        """return the n newest samples, oldest first"""
+        n = min(n,self.count)
+        return [self.samples[(self.next - n + i) % WINDOW] for i in range(n)]
+
+class LatencyTracker(object):
+    """LatencyTracker learns the response latency of every device and operation
+
+    The device records how long each prompt took to come back and asks here for
+    the timeout of its next expect. Until MIN_SAMPLES were observed the caller's
+    default is used; afterwards the timeout is FACTOR times the larger of the high
+    percentile and the moving average, clamped between a floor and a ceiling, so a
+    fast device stops waiting out fixed idle timeouts and a slow one is not timed
+    out spuriously. The clock is a plain function so a simulator can replace it.
+
+    A sweep sees a device for a few expects only, so the stats of a device are
+    carried from run to run: export() hands them to the session profile of the
+    device and seed() puts them back when the profile is loaded.
+
+    Attributes:
+        _stats   : a dictionary of device name to a dictionary of operation to its
+                   _Stats object
+        _lock    : a threading.Lock protecting the stats
+        _enabled : a boolean, when False every timeout is the caller's default
+        clock    : a function returning the current time in seconds
+    """
+
+    def __init__(self,enabled=True,clock=time.time):
+        self._stats   = {}
+        self._lock    = threading.Lock()
+        self._enabled = enabled
+        self.clock    = clock
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self,enabled):
+        self._enabled = enabled
+
+    def observe(self,name,operation,seconds):
+        """record the latency of an operation on a device"""
+        with self._lock:
+            device = self._stats.setdefault(name,{})
+            stats  = device.get(operation)
+            if stats is None:
+                stats = device[operation] = _Stats()
+            stats.observe(seconds)
+
+    def export(self,name):
+        """return the stats of a device in a form its session profile can persist
+
+           Returns:
+               A dictionary of operation to a dictionary with the keys ewma and
+               samples, the PERSISTED newest samples
+        """
+        with self._lock:
+            return dict([(operation,{"ewma"    : stats.ewma,
+                                     "samples" : [round(s,4) for s in stats.newest(PERSISTED)]}) \
+                         for operation,stats in self._stats.get(name,{}).items()])
+
+    def seed(self,name,learned):
+        """restore the stats a previous run exported for a device
+
+           The operations already observed by this run are left alone.
+
+           Args:
+               name    : a string holding the device name
+               learned : a dictionary as returned by export()
+        """
+        with self._lock:
+            device = self._stats.setdefault(name,{})
+            for operation,saved in learned.items():
+                if operation in device or saved.get("samples") in [None,[]]:
+                    continue
+                stats = device[str(operation)] = _Stats()
+                for seconds in saved["samples"][-WINDOW:]:
+                    stats.observe(seconds)
+                if saved.get("ewma") is not None:
+                    stats.ewma = saved["ewma"]
+
+    def timeout(self,name,operation,default,floor=0.5,ceiling=120):
+        """return the timeout of the next expect of an operation on a device
+
+           Args:
+               name      : a string holding the device name
+               operation : a string holding the operation, e.g. prompt or command
+               default   : a float holding the timeout used until enough samples exist
+               floor     : a float holding the smallest timeout returned
+               ceiling   : a float holding the largest timeout returned
+        """
+        if self._enabled == False:
+            return default
+        with self._lock:
+            stats = self._stats.get(name,{}).get(operation)
+            if stats is None or stats.count < MIN_SAMPLES:
+                return default
+            latency = max(stats.percentile(PERCENTILE),stats.ewma)
+        return min(ceiling,max(floor,FACTOR * latency))
+
+    def idle(self,name,operation,default,floor=0.5,ceiling=5):
+        """return the idle interval ending an output capture of an operation on a device
+
+           Unlike timeout(), the interval follows the moving average only: it is
+           waited after every complete output, so it is kept close to the usual
+           latency instead of covering its tail.
+        """
+        if self._enabled == False:
+            return default
+        with self._lock:
+            stats = self._stats.get(name,{}).get(operation)
+            if stats is None or stats.count < MIN_SAMPLES:
+                return default
+            latency = stats.ewma
+        return min(ceiling,max(floor,FACTOR * latency))
+
+    def _stats_items(self):
+        return [((name,operation),stats) for name,device in self._stats.items() \
+                for operation,stats in device.items()]
+
+    def report(self,name=None):
+        """return a dictionary of (device name,operation) to its ewma,p50,p99 and samples"""
+        with self._lock:
+            return dict([(key,{"ewma"    : stats.ewma,
+                               "p50"     : stats.percentile(0.5),
+                               "p99"     : stats.percentile(PERCENTILE),
+                               "samples" : stats.count}) \
+                         for key,stats in self._stats_items() \
+                         if name is None or key[0] == name])
+
+def percentiles(samples,points=(0.5,0.95,0.99)):
+    """return the given percentiles of a list of samples"""
+    ordered = sorted(samples)
+    return [ordered[min(len(ordered) - 1,int(p * len(ordered)))] for p in points]
+
+# Tracker shared by the devices of a run
+tracker = LatencyTracker()
@@ -0,0 +1,352 @@
+#!/usr/bin/python
+
+import pexpect
+import select
+import threading
+import time
+import os
+import re
+import device
+import journal
+
+# Compiled regular expressions to follow the boot progress of a device
+bootstrap_re      = re.compile("System\s+Bootstrap|Booting|Loading\s+\"?flash")
+press_return_re   = re.compile("Press\s+RETURN\s+to\s+get\s+started")
+rommon_re         = re.compile("rommon\s*\d*\s*>|switch:\s*$")
+
+# Boot states reported by the watcher
+BOOTING  = "booting"
+DIALOG   = "initial_dialog"
+READY    = "ready"
+ROMMON   = "rommon"
+TIMEOUT  = "timeout"
+LOST     = "lost"
+
+# Only the tail of the boot output is kept per device for matching
+TAIL_LENGTH = 2048
+
+# Seconds a reloaded device is given to come back
+BOOT_TIMEOUT = 900
+
+# Stage journaled while a reloaded device is followed by the watcher
+WATCH_STAGE = "watch_reload"
+
+class WatcherException(Exception):
+    def __init__(self,error_string):
+        self.error_string = error_string
+    def __str__(self):
+        return repr(self.error_string)
+
+class BootStatus(object):
+    """BootStatus holds the boot progress of a single device followed by the watcher
+
+    Attributes:
+        name      : a string holding the name of the device
+        state     : one of the boot states defined in this module
+        elapsed   : a float holding the seconds from the reload request to the prompt,
+                    None while the device has not come back
+        bootstrap : a float holding the seconds from the reload request to the first
+                    bootstrap banner, None if it was never seen
+        reattach  : an integer holding the number of times the console was re-attached
+    """
+
+    def __init__(self,name):
+        self.name      = name
+        self.state     = BOOTING
+        self.elapsed   = None
+        self.bootstrap = None
+        self.reattach  = 0
+
+    def __repr__(self):
+        return "BootStatus(%s,%s,%s)" % (self.name,self.state,self.elapsed)
+
+class ReloadWatcher(object):
+    """ReloadWatcher follows the boot progress of many reloaded devices at once
+
+    The watcher is fed with devices whose console session is still attached after
+    Device.reset() returned. All the sessions are polled from a single select.poll
+    loop, the boot output is matched as it arrives and each device is reported as
+    soon as the initial configuration dialog, the autoinstall prompt or an exec
+    prompt is seen. A session dropped by the terminal server is re-attached with
+    Device.reattach() when credentials are given.
+
+    The loop either runs in the caller with watch(), over the devices added
+    beforehand, or on a thread of its own between start() and stop(), in which case
+    the workers of a run add their devices while it runs. Each device is given
+    timeout seconds from its reload, and the on_done function it was added with is
+    called from the loop as soon as it is done.
+
+    Attributes:
+        _timeout  : a float holding the number of seconds to wait for each device
+        _username : a string holding the terminal server username used to re-attach
+        _password : a string holding the terminal server password used to re-attach
+        _attempt  : an integer holding the number of re-attach attempts per device
+        _pending  : a list of (device object,on_done) tuples not polled yet
+        _status   : a dictionary of device name to the BootStatus of the devices done
+        _lock     : a threading.Lock object protecting _pending and _stopping
+        _stopping : a boolean, True once no more devices are to be added
+        _wake     : a (read fd,write fd) pipe waking the loop up when a device is added,
+                    None unless the watcher was started
+        _thread   : the threading.Thread object running the loop, None unless started
+    """
+
+    def __init__(self,timeout=BOOT_TIMEOUT,username="",password="",attempt=2):
+        self._timeout  = timeout
+        self._username = username
+        self._password = password
+        self._attempt  = attempt
+        self._pending  = []
+        self._status   = {}
+        self._lock     = threading.Lock()
+        self._stopping = False
+        self._wake     = None
+        self._thread   = None
+
+    def add(self,dev,on_done=None):
+        """register a reloaded device to be watched
+
+           Args:
+               dev     : a device object with an attached console session
+               on_done : a function called with the device and its BootStatus object
+                         once the device came back, failed or timed out
+
+           Raises:
+               WatcherException : when the device has no console session
+        """
+        if dev.proc is None:
+            raise WatcherException("Device %s has no console session to watch" % dev.name)
+        with self._lock:
+            self._pending.append((dev,on_done))
+        if self._wake is not None:
+            os.write(self._wake[1],"+")
+
+    def start(self):
+        """start the loop on a thread of its own, devices are then added while it runs"""
+        self._stopping = False
+        self._wake     = os.pipe()
+        self._thread   = threading.Thread(target=self._loop)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def stop(self):
+        """wait for every device added so far to be done, then stop the thread
+
+           Returns:
+               A dictionary of device name to its BootStatus object
+        """
+        with self._lock:
+            self._stopping = True
+        os.write(self._wake[1],"+")
+        self._thread.join()
+        os.close(self._wake[0])
+        os.close(self._wake[1])
+        self._wake   = None
+        self._thread = None
+        return self._status
+
+    def watch(self):
+        """poll every registered console until all the devices came back or timed out
+
+           Returns:
+               A dictionary of device name to its BootStatus object
+        """
+        self._stopping = True
+        self._loop()
+        return self._status
+
+    def _loop(self):
+        poller  = select.poll()
+        mask    = select.POLLIN | select.POLLPRI | select.POLLHUP | select.POLLERR
+        fds     = {}
+        watched = {}
+        buffers = {}
+        if self._wake is not None:
+            poller.register(self._wake[0],select.POLLIN)
+
+        def done(name):
+            dev,boot_status,origin,on_done = watched.pop(name)
+            for fd in [fd for fd,other in fds.items() if other is dev]:
+                del fds[fd]
+                poller.unregister(fd)
+            del buffers[name]
+            self._status[name] = boot_status
+            if on_done is not None:
+                try:
+                    on_done(dev,boot_status)
+                except Exception:
+                    # on_done journals its own failures, the other devices go on
+                    pass
+
+        while True:
+            with self._lock:
+                pending,self._pending = self._pending,[]
+                stopping = self._stopping
+            for dev,on_done in pending:
+                origin = dev.reload_time if dev.reload_time is not None else time.time()
+                watched[dev.name] = (dev,BootStatus(dev.name),origin,on_done)
+                buffers[dev.name] = dev.proc.buffer if isinstance(dev.proc.buffer,str) else ""
+                fds[dev.proc.child_fd] = dev
+                poller.register(dev.proc.child_fd,mask)
+                if self._match(dev,watched[dev.name][1],buffers[dev.name],origin):
+                    done(dev.name)
+            if stopping and watched == {}:
+                return
+
+            now = time.time()
+            for name,(dev,boot_status,origin,on_done) in watched.items():
+                if now >= origin + self._timeout:
+                    boot_status.state = TIMEOUT
+                    dev.logger.error("Device %s did not come back within %s seconds" \
+                                     % (name,self._timeout))
+                    done(name)
+
+            wait = min([1.0] + [max(0.0,origin + self._timeout - now) \
+                                for dev,boot_status,origin,on_done in watched.values()])
+            for fd,event in poller.poll(int(wait * 1000)):
+                if self._wake is not None and fd == self._wake[0]:
+                    os.read(fd,512)
+                    continue
+                dev = fds.get(fd)
+                if dev is None:
+                    continue
+                boot_status,origin = watched[dev.name][1:3]
+                try:
+                    data = dev.proc.read_nonblocking(4096,timeout=0)
+                except pexpect.TIMEOUT:
+                    continue
+                except pexpect.EOF:
+                    del fds[fd]
+                    poller.unregister(fd)
+                    if self._reattach(dev,boot_status):
+                        fds[dev.proc.child_fd] = dev
+                        poller.register(dev.proc.child_fd,mask)
+                    else:
+                        done(dev.name)
+                    continue
+
+                buffers[dev.name] = (buffers[dev.name] + data)[-TAIL_LENGTH:]
+                if self._match(dev,boot_status,buffers[dev.name],origin):
+                    done(dev.name)
+
+    def _match(self,dev,boot_status,buf,origin):
+        """match the tail of the boot output, returns True once the device is done"""
+        if boot_status.bootstrap is None and bootstrap_re.search(buf):
+            boot_status.bootstrap = time.time() - origin
+            dev.logger.debug("Bootstrap banner seen after %.1f seconds" % boot_status.bootstrap)
+
+        if device.initial_dialog_re.search(buf) or device.auto_install_re.search(buf):
+            boot_status.state = DIALOG
+        elif press_return_re.search(buf) or device.unprivileged_re.search(buf) \
+                or device.privileged_re.search(buf):
+            boot_status.state = READY
+        elif rommon_re.search(buf):
+            boot_status.state = ROMMON
+            boot_status.elapsed = time.time() - origin
+            dev.logger.error("Device %s booted into rommon" % dev.name)
+            return True
+        else:
+            return False
+
+        boot_status.elapsed = time.time() - origin
+        dev.logger.info("Device %s came back (%s) after %.1f seconds" \
+                        % (dev.name,boot_status.state,boot_status.elapsed))
+        return True
+
+    def _reattach(self,dev,boot_status):
+        """re-attach a dropped console session, returns True if it succeeded"""
+        if self._username == "" or boot_status.reattach >= self._attempt:
+            boot_status.state = LOST
+            dev.logger.error("Console session to %s was lost during reload" % dev.name)
+            return False
+        boot_status.reattach = boot_status.reattach + 1
+        try:
+            dev.reattach(self._username,self._password)
+            return True
+        except (pexpect.EOF,pexpect.TIMEOUT):
+            boot_status.state = LOST
+            dev.logger.error("Unable to re-attach the console session to %s" % dev.name)
+            return False
+
+def watch_reload(device_list,timeout=BOOT_TIMEOUT,username="",password=""):
+    """follow the reload of a list of devices and return their BootStatus by name
+
+       Args:
+           device_list : a list of device objects which have just been reset
+           timeout     : a float holding the number of seconds to wait for each device
+           username    : a string holding the terminal server username to re-attach
+           password    : a string holding the terminal server password to re-attach
+
+       Returns:
+           A dictionary of device name to its BootStatus object
+    """
+    watcher = ReloadWatcher(timeout,username,password)
+    for dev in device_list:
+        watcher.add(dev)
+    return watcher.watch()
+
+def run_stages(reload_watcher,run_journal,dev,stages,board=None,done=None):
+    """run the stages of a device, handing it over to the watcher at its watch_reload stage
+
+       The stages up to watch_reload run in the calling worker. A device which was
+       reloaded is then added to the started watcher, which follows its boot along
+       with the other reloaded devices and, once the boot ended, runs the stages after
+       watch_reload, e.g. disconnect and post_process, journals the device COMPLETE or
+       FAILED and releases it. The worker is free for the next device meanwhile. A
+       device which was not reloaded, e.g. reset with mode replace, runs the rest of
+       its stages right away. The callable of the watch_reload stage is not used.
+
+       Args:
+           reload_watcher : a started ReloadWatcher object
+           run_journal    : a journal.Journal object
+           dev            : a device object
+           stages         : a list of (stage_name,callable) tuples run in order
+           board          : a dashboard.Dashboard object the transitions are posted to
+           done           : a function called with the device once the watcher
+                            released it
+
+       Returns:
+           True when the device was handed over to the watcher, False when all its
+           stages ran in the worker, which then releases it
+
+       Raises:
+           any exception raised by a stage run in the worker, after it has been
+           journaled as FAILED
+    """
+    names = [name for name,func in stages]
+    if WATCH_STAGE not in names:
+        journal.run_stages(run_journal,dev,stages,board)
+        return False
+    before = stages[:names.index(WATCH_STAGE)]
+    after  = stages[names.index(WATCH_STAGE) + 1:]
+    journal.run_stages(run_journal,dev,before,board,complete=False)
+    if dev.reload_time is None:
+        journal.run_stages(run_journal,dev,after,board)
+        return False
+
+    def record(status,error=""):
+        run_journal.record(dev.name,WATCH_STAGE,status,error)
+        if board is not None:
+            board.post(dev.name,WATCH_STAGE,status)
+
+    def on_done(dev,boot_status):
+        try:
+            if boot_status.state in [READY,DIALOG]:
+                record(journal.DONE)
+                journal.run_stages(run_journal,dev,after,board)
+            else:
+                record(journal.FAILED,"WatcherException")
+        except Exception:
+            pass
+        finally:
+            # a failed stage skipped post_process
+            dev.release()
+            if done is not None:
+                done(dev)
+
+    record(journal.STARTED)
+    try:
+        reload_watcher.add(dev,on_done)
+    except WatcherException:
+        record(journal.FAILED,"WatcherException")
+        raise
+    return True